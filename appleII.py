@@ -23,19 +23,350 @@
 #   Speed enhancements based on blog post by Joao Bueno and Akkana Peck
 
 from array import array
+from operator import add
+import struct
 
 from gimpfu import *
 gettext.install("gimp20-python", gimp.locale_directory, unicode=True)
 
+# Define two halftone clusters - tuples used for speed
+cluster = ((( 0,  6,  8, 14),
+            ( 2, 12,  4, 10),
+            ( 8, 14,  0,  6),
+            ( 4, 10,  2, 12)),
+           (( 0, 12,  3, 15),
+            ( 8,  4, 11,  7),
+            ( 2, 14,  1, 13),
+            (10,  6,  9,  5)))
+
+# Define Apple II palette - a colour's index is (green * 4) + (red * 2) + 
+# blue, with orange added on the end
+colours = ((0x00, 0x00, 0x00), (0x00, 0x00, 0xFF),
+           (0xFF, 0x00, 0x00), (0xFF, 0x00, 0xFF),
+           (0x00, 0xFF, 0x00), (0x00, 0xFF, 0xFF),
+           (0xFF, 0xFF, 0x00), (0xFF, 0xFF, 0xFF),
+           (0xFF, 0x7F, 0x00))
+
+BLACK, BLUE, RED, MAGENTA, GREEN, CYAN, YELLOW, WHITE, ORANGE = range(0, 9)
+
+# Define primary table
+prim_table = ((0, 1), (1, 2), (2, 2), (1, 0),
+              (2, 0), (1, 2), (2, 2), (3, 1))
+
+def group_colours(key, edge):
+
+    # Colours of a group of 7 pixels, from the flags (yed) of the group and
+    # two pixels either side in the bottom 11 bits of the key, whether the
+    # group starts on an odd pixel, then the group's palette bit (q). The
+    # left edge group can't turn its first two pixels white together.
+    yed = [(key >> i) & 1 for i in range(0, 11)]
+    odd = (key >> 11) & 1
+    q = (key >> 12) & 1
+
+    # A pair of lit pixels next to each other is white
+    pairs = [yed[i] and yed[i + 1] and not (edge and i == 2)
+             for i in range(0, 10)]
+    white = [0] + [pairs[i - 1] or pairs[i] for i in range(1, 10)] + [0]
+
+    group = []
+    for i in range(2, 9):
+
+        # Even pixels are magenta and odd ones green, unless they are 
+        # between two lit pixels of the other phase
+        if (odd + i) % 2 == 0:
+            own, between = MAGENTA, GREEN
+        else:
+            own, between = GREEN, MAGENTA
+        if yed[i - 1] and yed[i + 1]:
+            colour = between
+        elif yed[i]:
+            colour = own
+        else:
+            colour = BLACK
+
+        # White pixels win, and close single pixel gaps between them
+        if white[i]:
+            colour = WHITE
+        elif white[i - 1] and white[i + 1]:
+            colour = BLACK
+
+        # The group's flag shifts magenta to blue and green to orange
+        if q and colour == MAGENTA:
+            colour = BLUE
+        elif q and colour == GREEN:
+            colour = ORANGE
+
+        group.append(colour)
+
+    return tuple(group)
+
+# Colours of every group of 7 pixels, for groups away from the left edge 
+# and the one at it, built the first time they're needed
+group_tables = {}
+
+def group_table(edge):
+    if edge not in group_tables:
+        group_tables[edge] = tuple([group_colours(key, edge) 
+                                    for key in range(0, 8192)])
+    return group_tables[edge]
+
+# Flags an even pixel leaves lit - its own in bit 0 and 
+# the next pixel's in bit 1 - and colour flag of each palette index
+lit_pair = tuple([apv for apv, cfl in prim_table])
+lit_group = tuple([cfl for apv, cfl in prim_table])
+
+def scanline(rrow, grow, brow, levels, width, spans, hires):
+
+    # Palette index of each pixel once each channel is switched fully on
+    # or off at its level - pixels past the edge count as black
+    prim = [((g > lv) * 4) + ((r > lv) * 2) + (b > lv) 
+            for r, g, b, lv in zip(rrow, grow, brow, levels)] + [BLACK] * 14
+    cfls = map(lit_group.__getitem__, prim)
+
+    # Work along the scanline a group of 7 pixels at a time, keeping the 
+    # flags from 9 pixels before the group in a window. A group's colours 
+    # need the flags of the first two pixels of the next, so each group is 
+    # looked up once the next one is done.
+    line = []
+    window = 0
+    q = 0
+    for x1 in range(0, ((width + 6) / 7) + 1):
+        x0 = x1 * 7
+        group = prim[x0 : x0 + 7]
+
+        # Flags lit by the group's even pixels - a pixel can light the flag
+        # of the one after it, but not past the right edge
+        if x0 % 2 == 0:
+            flags = (lit_pair[group[0]] | (lit_pair[group[2]] << 2) | 
+                     (lit_pair[group[4]] << 4) | (lit_pair[group[6]] << 6))
+        else:
+            flags = ((lit_pair[group[1]] << 1) | (lit_pair[group[3]] << 3) | 
+                     (lit_pair[group[5]] << 5))
+        if x0 + 8 > width:
+            flags = flags & ((1 << max(width - x0, 0)) - 1)
+        window = window | (flags << 9)
+
+        # Colour in the last group - spans holds its pixels as a string for
+        # each key and edge - and add its hi-res byte, the group's pixels 
+        # from bit 0 with its flag as the palette bit
+        if x1 > 0:
+            key = (window & 0x7FF) | (((x1 - 1) & 1) << 11) | (q << 12)
+            line.append(spans[x1 == 1][key])
+            hires.append(((window >> 2) & 0x7F) | (q << 7))
+        window = window >> 7
+
+        # The group's flag is set if its colour flags add up to 8 or more
+        q = 0
+        if sum(cfls[x0 : x0 + 7]) >= 8:
+            q = 1
+
+    return "".join(line)
+
+def ink(r, g, b, pxl_size):
+    rgba = array("B", "\xff" * pxl_size)
+    rgba[0], rgba[1], rgba[2] = r, g, b
+    return rgba
+
+def group_spans(pxl_size):
+
+    # Each palette colour as a pixel, and each group of 7 pixels as a 
+    # string of them
+    inks = [ink(r, g, b, pxl_size).tostring() for r, g, b in colours]
+    spans = [["".join([inks[i] for i in group]) for group in group_table(edge)]
+             for edge in (False, True)]
+    return inks, spans
+
+def hires_render(hires, cols, lines, pxl_size):
+
+    # Colour in hi-res bytes a scanline at a time, sliding each byte's 
+    # pixels into a window the same way the filter does
+    inks, spans = group_spans(pxl_size)
+    pixels = []
+    for y in range(0, lines):
+        row = hires[y * cols : (y + 1) * cols]
+        window = 0
+        for x1 in range(0, cols + 1):
+            if x1 < cols:
+                window = window | ((row[x1] & 0x7F) << 9)
+            if x1 > 0:
+                key = ((window & 0x7FF) | (((x1 - 1) & 1) << 11) | 
+                       ((row[x1 - 1] >> 7) << 12))
+                pixels.append(spans[x1 == 1][key])
+            window = window >> 7
+
+    return "".join(pixels)
+
+class HiResScreen(object):
+
+    # Everything one conversion works with - the image's width and colour
+    # depth, its pixels for each palette colour and group of 7, its halftone
+    # levels - so conversions running at the same time share nothing but the
+    # group tables, which never change once they're built
+
+    def __init__(self, width, pxl_size, halftone, pattern):
+        self.width = width
+        self.pxl_size = pxl_size
+
+        # Each palette colour as a pixel, and each group of 7 pixels as a 
+        # string of them
+        self.spans = group_spans(pxl_size)[1]
+
+        # The hi-res screen - a byte for each group of 7 pixels, in reading
+        # order
+        self.cols = (width + 6) / 7
+        self.hires = array("B")
+
+        # Level each channel must be above to be switched on - the halftone
+        # cluster, or half way
+        if halftone:
+            self.levels = [[(((cluster[pattern][y2][x % 4] + 1) * 255) / 16)
+                            for x in range(0, width)] for y2 in range(0, 4)]
+        else:
+            self.levels = [[127] * width] * 4
+
+    def line(self, pxl, y):
+
+        # Read the scanline a channel at a time, and colour it in
+        width, pxl_size = self.width, self.pxl_size
+        span = width * pxl_size
+        pos = y * span
+        pixels = scanline(pxl[pos : pos + span : pxl_size],
+                          pxl[pos + 1 : pos + span : pxl_size],
+                          pxl[pos + 2 : pos + span : pxl_size],
+                          self.levels[y % 4], width, self.spans, 
+                          self.hires)[0:span]
+
+        return pixels
+
+# The hi-res screen is kept with the layer as a parasite - byte columns 
+# and scanlines, then the bytes
+def attach_hires(drawable, cols, lines, hires):
+    drawable.attach_new_parasite("apple2-hires",
+                                 (gimp.PARASITE_PERSISTENT | 
+                                  gimp.PARASITE_UNDOABLE), 
+                                 struct.pack("<II", cols, lines) + 
+                                 hires.tostring())
+
+def find_hires(drawable):
+    parasite = drawable.parasite_find("apple2-hires")
+    if parasite is None:
+        return None
+    data = parasite.data
+    cols, lines = struct.unpack("<II", data[0:8])
+    return cols, lines, array("B", data[8 : 8 + cols * lines])
+
+# Most hi-res bytes kept with a layer, one for each group of 7 pixels -
+# about 600K of parasite, for a 2100 x 2048 image. Bigger images aren't
+# given one, as it would be held in memory and saved with the image.
+parasite_groups = 300 * 2048
+
+# Start of each scanline in an HGR file - the 8 scanlines of a character 
+# row are 0x400 bytes apart, the 8 character rows of a third 0x80 apart, 
+# and the thirds 40 bytes apart
+hgr_rows = tuple([((y & 7) << 10) | ((y & 0x38) << 4) | ((y >> 6) * 40)
+                  for y in range(0, 192)])
+
+def apple_hgr(hires, cols, lines):
+
+    # An HGR file holds a full 40 byte by 192 scanline screen, so the 
+    # screen is cropped or padded with black to fit
+    hgr = array("B", "\x00" * 8192)
+    span = min(cols, 40)
+    for y in range(0, min(lines, 192)):
+        pos = cols * y
+        hgr[hgr_rows[y] : hgr_rows[y] + span] = hires[pos : pos + span]
+
+    return hgr.tostring()
+
+def apple_unhgr(data):
+
+    # Put the scanlines back into reading order
+    hires = array("B")
+    for y in range(0, 192):
+        hires.fromstring(data[hgr_rows[y] : hgr_rows[y] + 40])
+
+    return hires
+
+def hires_matches(drawable, screen):
+
+    # A screen left with a layer only still holds if the layer shows it -
+    # the layer may have been painted on since. The screen is coloured in
+    # whole groups of 7 pixels, so only the layer's width of each scanline
+    # is compared.
+    cols, lines, hires = screen
+    width, height = drawable.width, drawable.height
+    if (cols, lines) != ((width + 6) / 7, height):
+        return False
+    src_rgn = drawable.get_pixel_rgn(0, 0, width, height, False, False)
+    pxl_size = src_rgn.bpp
+    pixels = hires_render(hires, cols, lines, pxl_size)
+    span, full = width * pxl_size, cols * 7 * pxl_size
+    return "".join([pixels[y * full : y * full + span]
+                    for y in range(0, lines)]) == src_rgn[0:width, 0:height]
+
+def drawable_hires(drawable):
+
+    # Use the screen left by the Apple II filter if the layer still shows 
+    # it, otherwise work it out with the filter's default settings
+    screen = find_hires(drawable)
+    if screen is None or not hires_matches(drawable, screen):
+        width, height = drawable.width, drawable.height
+        src_rgn = drawable.get_pixel_rgn(0, 0, width, height, False, False)
+        src_pxl = array("B", src_rgn[0:width, 0:height])
+        hires_screen = HiResScreen(width, src_rgn.bpp, True, 0)
+        for y in range(0, height):
+            hires_screen.line(src_pxl, y)
+        screen = (hires_screen.cols, height, hires_screen.hires)
+
+    return screen
+
+def save_hgr(img, drawable, filename, raw_filename):
+
+    gimp.progress_init(_("Saving %s") % filename)
+    cols, lines, hires = drawable_hires(drawable)
+
+    hgr_file = open(filename, "wb")
+    hgr_file.write(apple_hgr(hires, cols, lines))
+    hgr_file.close()
+
+def load_hgr(filename, raw_filename):
+
+    # Files saved without the last screen hole are 8184 bytes long
+    hgr_file = open(filename, "rb")
+    data = hgr_file.read(8192)
+    hgr_file.close()
+    if len(data) < 8184:
+        raise IOError(_("%s is too short to be an Apple II hi-res screen") 
+                      % filename)
+
+    # Colour in the screen as a new image
+    hires = apple_unhgr(data)
+    img = gimp.Image(280, 192, RGB)
+    layer = gimp.Layer(img, _("Background"), 280, 192, 
+                       RGB_IMAGE, 100, NORMAL_MODE)
+    img.add_layer(layer, 0)
+    dst_rgn = layer.get_pixel_rgn(0, 0, 280, 192, True, False)
+    dst_rgn[0:280, 0:192] = hires_render(hires, 40, 192, dst_rgn.bpp)
+    layer.update(0, 0, 280, 192)
+
+    # Keep the screen with the layer so it can be saved again
+    attach_hires(layer, 40, 192, hires)
+    img.filename = filename
+
+    return img
+
+# Each file procedure registers its own handler once it has been installed
+def register_hgr_load():
+    gimp.register_load_handler("file-apple2hgr-load", "hgr", "")
+
+def register_hgr_save():
+    gimp.register_save_handler("file-apple2hgr-save", "hgr", "")
+
 def apple2(img, layer, halftone, pattern):
 
     gimp.context_push()
     img.undo_group_start()
 
-    # Set up globals
-    global width, height, height2 
-    global dst_pxl, pxl_size
-
     # Width and height stored in variables for speed
     width = img.width 
     height = img.height
@@ -45,215 +376,167 @@ def apple2(img, layer, halftone, pattern):
     new_layer = pdb.gimp_layer_copy(layer, False)
     pdb.gimp_image_add_layer(img, new_layer, position)
 
-    # Resize the new layer to create two "buffer" scanlines
-    height2 = height + 2
-    pdb.gimp_layer_resize(new_layer, width, height2, 0, 0)
-
     # Create a copy of the image to write to
     dst_rgn = new_layer.get_pixel_rgn(0,            # x
                                       0,            # y
                                       width,        # w
-                                      height2,      # h
+                                      height,       # h
                                       True,         # dirty
                                       False )       # shadow
-    dst_pxl = array("B", dst_rgn[0:width, 0:height2])
+    dst_pxl = array("B", dst_rgn[0:width, 0:height])
 
     # Work out colour depth of image
     pxl_size = dst_rgn.bpp
+    screen = HiResScreen(width, pxl_size, halftone, pattern)
 
-    # Define two halftone clusters - tuples used for speed
-    cluster = ((( 0,  6,  8, 14),
-                ( 2, 12,  4, 10),
-                ( 8, 14,  0,  6),
-                ( 4, 10,  2, 12)),
-               (( 0, 12,  3, 15),
-                ( 8,  4, 11,  7),
-                ( 2, 14,  1, 13),
-                (10,  6,  9,  5)))
-
-    # Define Apple II palette
-    colours = ((0x00, 0x00, 0x00), (0x00, 0x00, 0xFF),
-               (0xFF, 0x00, 0x00), (0xFF, 0x00, 0xFF),
-               (0x00, 0xFF, 0x00), (0x00, 0xFF, 0xFF),
-               (0xFF, 0xFF, 0x00), (0xFF, 0xFF, 0xFF))
-
-    BLACK     = ink(0x00, 0x00, 0x00)
-    BLUE      = ink(0x00, 0x00, 0xFF)
-    RED       = ink(0xFF, 0x00, 0x00)
-    MAGENTA   = ink(0xFF, 0x00, 0xFF)
-    GREEN     = ink(0x00, 0xFF, 0x00)
-    CYAN      = ink(0x00, 0xFF, 0xFF)
-    YELLOW    = ink(0xFF, 0xFF, 0x00)
-    WHITE     = ink(0xFF, 0xFF, 0xFF)
-
-    # Define primary table
-    prim_table = ((0, 1), (1, 2), (2, 2), (1, 0),
-                  (2, 0), (1, 2), (2, 2), (3, 1))
-
-    # Used on toolbar
-    ipass = 1  
+    # Initialise progress bar
+    gimp.progress_init("Apple II (Colour) Image Filter")
 
-    if halftone:
+    # Process image a scanline at a time
+    lines = []
+    for y in range(0, height):
+
+        # Update progress bar
+        gimp.progress_update(float(y) / height)
+        lines.append(screen.line(dst_pxl, y))
 
-        # Process images with halftones
+    dst_rgn[0:width, 0:height] = "".join(lines)
 
-        # Initialise progress bar
-        gimp.progress_init("Apple II (Colour) Image Filter - Pass " + str(ipass))
-        
-        for y in range(0, height):
+    new_layer.update(0, 0, width, height)
+    layer = pdb.gimp_image_merge_down(img, new_layer, CLIP_TO_IMAGE)
 
-            # Update progress bar
-            gimp.progress_init("Apple II (Colour) Image Filter - Pass " + str(ipass))
-            gimp.progress_update(float(y) / height)
+    # Keep the hi-res screen with the layer so it can be saved as an HGR 
+    # file, unless the image is too big for it - a screen left by an 
+    # earlier run no longer matches the layer either way
+    if screen.cols * height <= parasite_groups:
+        attach_hires(layer, screen.cols, height, screen.hires)
+    elif layer.parasite_find("apple2-hires") is not None:
+        layer.parasite_detach("apple2-hires")
 
-            for x in range(0, width):
-                rgba = point(x, y)
-                r, g, b = rgba[0], rgba[1], rgba[2]
-         
-                patgf = (((cluster[pattern][y % 4][x % 4] + 1) * 255) / 16)
-                rpat = 1 if r > patgf else 0
-                gpat = 1 if g > patgf else 0
-                bpat = 1 if b > patgf else 0
-                o4b = (bpat + (rpat * 2) + (gpat * 4)) % 8
+    img.undo_group_end()
+    gimp.context_pop()
+
+# Double hi-res palette - a colour's index is its pattern of lit pixels
+# in a group of 4, the first pixel in bit 0
+dhr_colours = ((0x00, 0x00, 0x00), (0xDD, 0x00, 0x33),
+               (0x00, 0x00, 0x99), (0xDD, 0x22, 0xDD),
+               (0x00, 0x77, 0x22), (0x55, 0x55, 0x55),
+               (0x22, 0x22, 0xFF), (0x66, 0xAA, 0xFF),
+               (0x88, 0x55, 0x00), (0xFF, 0x66, 0x00),
+               (0xAA, 0xAA, 0xAA), (0xFF, 0x99, 0x88),
+               (0x11, 0xDD, 0x00), (0xFF, 0xFF, 0x00),
+               (0x44, 0xFF, 0x99), (0xFF, 0xFF, 0xFF))
+
+# Nearest double hi-res colour to each colour with 4 bits per channel, 
+# packed as 0xRGB, built the first time it's needed
+dhr_tables = []
+
+def dhr_table():
+    if not dhr_tables:
+        nearest = []
+        for rgb in range(0, 4096):
+            r, g, b = (rgb >> 8) * 17, ((rgb >> 4) & 15) * 17, (rgb & 15) * 17
+            dists = [((r - pr) ** 2) + ((g - pg) ** 2) + ((b - pb) ** 2)
+                     for pr, pg, pb in dhr_colours]
+            nearest.append(dists.index(min(dists)))
+        dhr_tables.append(tuple(nearest))
+    return dhr_tables[0]
+
+# The 4 bits of a channel for the total of a group's 4 pixels plus its 
+# halftone offset, offset by 256 so it can't be negative - moved to where
+# it goes in the packed colour
+def make_dhr_levels():
+    levels = [min(max((i - 256) / 4, 0), 255) >> 4 for i in range(0, 1536)]
+    return (tuple([lv << 8 for lv in levels]), 
+            tuple([lv << 4 for lv in levels]),
+            tuple(levels))
+
+dhr_red, dhr_green, dhr_blue = make_dhr_levels()
+
+def dhr_line(rrow, grow, brow, offsets, nearest, spans):
+
+    # Total each channel over every group of 4 pixels, add the halftone 
+    # offsets, then look up the group's colour and its 4 pixels - a whole
+    # scanline at a time
+    totals = [map(add, map(add, row[0::4], row[1::4]), 
+                  map(add, row[2::4], row[3::4]))
+              for row in (rrow, grow, brow)]
+    reds = map(dhr_red.__getitem__, map(add, totals[0], offsets))
+    greens = map(dhr_green.__getitem__, map(add, totals[1], offsets))
+    blues = map(dhr_blue.__getitem__, map(add, totals[2], offsets))
+    rgb = map(add, map(add, reds, greens), blues)
+
+    return "".join(map(spans.__getitem__, map(nearest.__getitem__, rgb)))
+
+def apple2dhr(img, layer, halftone, pattern):
+
+    gimp.context_push()
+    img.undo_group_start()
+
+    # Width and height stored in variables for speed
+    width = img.width 
+    height = img.height
+
+    # Create a new duplicate layer above the existing one
+    position = pdb.gimp_image_get_layer_position(img, layer)
+    new_layer = pdb.gimp_layer_copy(layer, False)
+    pdb.gimp_image_add_layer(img, new_layer, position)
 
-                rgba = ink(colours[o4b][0], colours[o4b][1], colours[o4b][2])
-                dot(x, y, rgba)          
-        
-        ipass += 1
+    # Create a copy of the image to write to
+    dst_rgn = new_layer.get_pixel_rgn(0,            # x
+                                      0,            # y
+                                      width,        # w
+                                      height,       # h
+                                      True,         # dirty
+                                      False )       # shadow
+    dst_pxl = array("B", dst_rgn[0:width, 0:height])
 
+    # Work out colour depth of image, and how many groups of 4 pixels make
+    # up a scanline - the last is padded with black
+    pxl_size = dst_rgn.bpp
+    span = width * pxl_size
+    groups = (width + 3) / 4
+    padding = array("B", "\x00" * (groups * 4 - width))
 
-    # Colour Correction
+    # Each colour as a group of 4 pixels
+    spans = [ink(r, g, b, pxl_size).tostring() * 4 for r, g, b in dhr_colours]
+    nearest = dhr_table()
 
-    # Set buffer line
-    yed = height2 - 2
+    # Offset added to each group's channel totals - the halftone cluster 
+    # spread either side of zero, plus 256
+    if halftone:
+        offsets = [[256 + ((((cluster[pattern][y2][x1 % 4] + 1) * 255) / 16) 
+                           - 128) * 2
+                    for x1 in range(0, groups)] for y2 in range(0, 4)]
+    else:
+        offsets = [[256] * groups] * 4
 
     # Initialise progress bar
-    gimp.progress_init("Apple II Image Filter - Pass " + str(ipass))
+    gimp.progress_init("Apple II (Double Hi-Res) Image Filter")
 
     # Process image a scanline at a time
+    lines = []
     for y in range(0, height):
 
         # Update progress bar
         gimp.progress_update(float(y) / height)
 
-        # Use scanline to create proccessed buffer scanline (yed)
-
-        for x1 in range(0, (width / 7) + 2):
-            cflc = 0
-            for x2 in range (0, 7):
-                x = x2 + (x1 * 7)
-                rgba = point(x, y)
-                r, g, b = rgba[0], rgba[1], rgba[2]
-
-                prim = (g / 128) * 4  + (r / 128) * 2 + (b / 128) 
-                apv, cfl = prim_table[prim]
-                if(x % 2) == 0: 
-                    if apv in (0, 2):
-                        dot(x, yed, BLACK)
-                    if apv in (0, 1): 
-                        dot(x + 1, yed, BLACK)
-
-                cflc = cflc + cfl
-
-            if cflc < 8:
-                dot(x1, yed + 1, BLACK)
-
-        # Clear scanline in actual image    
-        blank_line(y, BLACK)
-
-        for x in range(0, width, 2):
-            rgba = point(x, yed)
-            b = rgba[2]
-            if b > 127:
-                dot(x, y, MAGENTA)
-        for x in range(1, width, 2):
-            rgba = point(x, yed)
-            b = rgba[2]
-            if b > 127:
-                dot(x, y, GREEN)
-     
-        for x in range(0, width - 2, 2):
-            rgba1 = point(x, yed) 
-            rgba2 = point(x + 2, yed)
-            b1 = rgba1[2]
-            b2 = rgba2[2]
-            if (b1 > 127) and (b2 > 127):
-                dot(x + 1, y, MAGENTA)
-
-        for x in range(1, width - 2, 2):
-            rgba1 = point(x, yed) 
-            rgba2 = point(x + 2, yed)
-            b1 = rgba1[2]
-            b2 = rgba2[2]
-            if (b1 > 127) and (b2 > 127):
-                dot(x + 1, y, GREEN)
-
-        for x in range(1, width - 1):
-            rgba1 = point(x, yed) 
-            rgba2 = point(x + 1, yed)
-            b1 = rgba1[2]
-            b2 = rgba2[2]
-            if (b1 > 127) and (b2 > 127):
-                dot(x, y, WHITE)
-                dot(x + 1, y, WHITE)
-
-        for x in range(1, width - 2):
-            rgba1 = point(x, y) 
-            rgba2 = point(x + 1, y)
-            rgba3 = point(x + 2, y)
-            white_pxl = array("B", "\xff" * pxl_size)
-            if (rgba1 == white_pxl and 
-                rgba3 == white_pxl and
-                rgba2 != white_pxl):
-                dot (x + 1, y, BLACK)
-
-        for x1 in range(0, (width / 7) + 2):
-            q = point(x1, yed + 1)
-            q = q[2]
-            for x2 in range(0, 7):
-                n = point(x1 * 7 + x2, y)
-                if(n == MAGENTA) and q > 128:
-                    n = BLUE;
-                if(n == GREEN) and q > 128:
-                    n = ink(0xff,0x7f,0x00)
-                dot(x1 * 7 + x2, y, n)
-
-        blank_line(yed, WHITE)
-        blank_line(yed + 1, WHITE)
-
-    dst_rgn[0:width, 0:height2] = dst_pxl.tostring()
-
-    new_layer.update(0, 0, width, height2)
+        # Read the scanline a channel at a time, and colour it in
+        pos = y * span
+        rrow = dst_pxl[pos : pos + span : pxl_size] + padding
+        grow = dst_pxl[pos + 1 : pos + span : pxl_size] + padding
+        brow = dst_pxl[pos + 2 : pos + span : pxl_size] + padding
+        lines.append(dhr_line(rrow, grow, brow, offsets[y % 4], nearest,
+                              spans)[0:span])
+
+    dst_rgn[0:width, 0:height] = "".join(lines)
+
+    new_layer.update(0, 0, width, height)
     layer = pdb.gimp_image_merge_down(img, new_layer, CLIP_TO_IMAGE)
 
     img.undo_group_end()
     gimp.context_pop()
 
-def ink(r, g, b):
-    rgba = array("B", "\xff" * pxl_size)
-    rgba[0], rgba[1], rgba[2] = r, g, b
-    return rgba
-
-def dot(x, y, rgba):
-    global dst_pxl
-    if x in range(width):
-        dst_pos = (x + width * y) * pxl_size
-        dst_pxl[dst_pos : dst_pos + pxl_size] = rgba
-
-
-def point(x, y):
-    if x in range(width):
-        dst_pos = (x + width * y) * pxl_size
-        return dst_pxl[dst_pos: dst_pos + pxl_size]
-    else:
-        return [0] * pxl_size
-
-def blank_line(y, rgba):
-    global dst_pxl
-    line = array("B", rgba * width)
-    dst_pos = (width * y) * pxl_size
-    dst_pxl[dst_pos : dst_pos + (pxl_size * width)] = line
-
 register("python-fu-apple2",
          N_("AppleII (Colour) Image Filter"),
          "",
@@ -274,4 +557,60 @@ register("python-fu-apple2",
          apple2, 
          menu="<Image>/Filters/Retro Computing",
          domain=("gimp20-python", gimp.locale_directory))
+
+register("python-fu-apple2-double",
+         N_("AppleII (Double Hi-Res) Image Filter"),
+         "",
+         "Dave Jeffery",
+         "Dave Jeffery",
+         "2010",
+         N_("AppleII (_Double Hi-Res)"),
+         "RGB*",
+         [(PF_IMAGE, "image", _("Input image"), None),
+          (PF_DRAWABLE, "drawable", _("Input drawable"), None),
+          (PF_TOGGLE, "halftone", _("Use halftones?"), True),
+          (PF_RADIO, "pattern", _("Halftone cluster"), 0,
+           ((_("One"), 0),
+            (_("Two"), 1)))
+          ],
+         [],
+         apple2dhr, 
+         menu="<Image>/Filters/Retro Computing",
+         domain=("gimp20-python", gimp.locale_directory))
+
+register("file-apple2hgr-load",
+         N_("Load an Apple II hi-res screen (.HGR)"),
+         "",
+         "Dave Jeffery",
+         "Dave Jeffery",
+         "2010",
+         N_("Apple II hi-res screen"),
+         None,
+         [(PF_STRING, "filename", _("The name of the file to load"), None),
+          (PF_STRING, "raw-filename", _("The name entered"), None)
+         ],
+         [(PF_IMAGE, "image", _("Output image"))],
+         load_hgr, 
+         on_query=register_hgr_load,
+         menu="<Load>",
+         domain=("gimp20-python", gimp.locale_directory))
+
+register("file-apple2hgr-save",
+         N_("Save as an Apple II hi-res screen (.HGR)"),
+         "",
+         "Dave Jeffery",
+         "Dave Jeffery",
+         "2010",
+         N_("Apple II hi-res screen"),
+         "RGB*",
+         [(PF_IMAGE, "image", _("Input image"), None),
+          (PF_DRAWABLE, "drawable", _("Input drawable"), None),
+          (PF_STRING, "filename", _("The name of the file to save"), None),
+          (PF_STRING, "raw-filename", _("The name entered"), None)
+         ],
+         [],
+         save_hgr, 
+         on_query=register_hgr_save,
+         menu="<Save>",
+         domain=("gimp20-python", gimp.locale_directory))
 main()
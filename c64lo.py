@@ -23,165 +23,133 @@
 #   Speed enhancements based on blog post by Joao Bueno and Akkana Peck
 
 from array import array
-from math import sqrt
+from operator import add
+import struct
 
 from gimpfu import *
 gettext.install("gimp20-python", gimp.locale_directory, unicode=True)
 
+# Set up Commodore 64 palette
+colourid = (0x000, 0xFFF, 0x931, 0x5BD, 
+            0x93C, 0x4A1, 0x32C, 0xBD3, 
+            0x950, 0x440, 0xC64, 0x444, 
+            0x777, 0x8E5, 0x75F, 0x999)
+
+def make_nearest(palette):
+
+    # Index of the nearest palette colour to every colour with 4 bits per
+    # channel, packed as 0xRGB. Squared distances are compared, which 
+    # orders the colours the same as the distances themselves, and the 
+    # first of any equally near colours is taken.
+    nearest = []
+    for rgb in range(0, 4096):
+        rlv2, glv2, blv2 = rgb / 256, (rgb / 16) & 15, rgb & 15
+        u, dis = 0, 1000
+        for i, c in enumerate(palette):
+            rlv,  glv,  blv = c / 256, (c / 16) & 15, c & 15  
+            rgbdist = ((rlv - rlv2) ** 2) + ((glv - glv2) ** 2) + \
+                      ((blv - blv2) ** 2)
+            if rgbdist < dis:
+                dis = rgbdist
+                u = i
+        nearest.append(u)
+    return tuple(nearest)
+
+nearest = make_nearest(colourid)
+
+def make_palette(palette):
+
+    # Grey level and 8 bit RGB value of each palette colour
+    iklv, colourid2 = [], []
+    for u in palette:
+        rlv = u / 256    
+        glv = (u / 16) & 15
+        blv = u & 15
+        iklv.append(((blv * 11) + (glv * 59) + (rlv * 30)) / 15)
+        colourid2.append( ( int((rlv / 15.0) * 255),
+                            int((glv / 15.0) * 255),
+                            int((blv / 15.0) * 255) ) )
+    return tuple(iklv), tuple(colourid2)
 
-class ColourMap(object):
-    def __init__(self, width=40, height=32, colours=16):
-        self.width = width
-        self.height = height        
-        self.colours = colours
-        self.pixmap = array("B", "\x00" * (width * height * colours))
-
-    def add_pixel(self, x, y, c):
-        self.pixmap[((x + self.width * y) * self.colours) + c] += 1
-
-    def set_pixel(self, x, y, c, v):
-        self.pixmap[((x + self.width * y) * self.colours) + c] = v
-
-    def get_pixel(self, x, y, c):
-        return self.pixmap[((x + self.width * y) * self.colours) + c]
-
-
-def c64lo(img, layer):
-
-    # Store the GIMP's settings so they can be restored when we're finished
-    gimp.context_push()
-
-    # Make all the operations in this filter undo in one group
-    img.undo_group_start()
-
-    # Set up constants
-    width = img.width
-    height = img.height
+iklv, colourid2 = make_palette(colourid)
 
-    # Create a new black layer above the existing one
-    position = pdb.gimp_image_get_layer_position(img, layer)
-    gimp.set_background(0, 0, 0)
-    black_layer = gimp.Layer(img, "Black Layer", width, height, 
-                             RGB_IMAGE, 100, NORMAL_MODE)
-    pdb.gimp_image_add_layer(img, black_layer, position)
+# Top 4 bits of each channel, moved to where they go in a packed 0xRGB 
+# colour
+red_bits = tuple([(j / 16) << 8 for j in range(0, 256)])
+green_bits = tuple([(j / 16) << 4 for j in range(0, 256)])
+blue_bits = tuple([j / 16 for j in range(0, 256)])
 
-    # Create a copy of the image as a new layer above the black one
-    position = pdb.gimp_image_get_layer_position(img, black_layer)
-    new_layer = pdb.gimp_layer_copy(layer, False)
-    pdb.gimp_image_add_layer(img, new_layer, position)
-
-    # Specify the new layer as the pixel region we'll work with
-    dst_rgn = new_layer.get_pixel_rgn(0,            # x
-                                      0,            # y
-                                      width,        # w
-                                      height,       # h
-                                      True,         # dirty
-                                      False )       # shadow
-    
-    # Store the copy of the pixel region in a byte array for speed
-    dst_pxl = array("B", dst_rgn[0:width, 0:height])
-
-    # Work out colour depth of image
-    pxl_size = dst_rgn.bpp
+def c64_screen(pxl, width, height, pxl_size):
 
     # Work out width and height on image in 8x8 characters and 4x8 cells
     w_chars = width / 8
     h_chars = height / 8
   
-    # No pixels of each colour in each character
-    cr = ColourMap(w_chars, h_chars, 16)
+    # No pixels of each colour in each character - 16 counts for each 
+    # character in reading order
+    cells = w_chars * h_chars
+    cr = array("B", "\x00" * (cells * 16))
 
     # No of colours in each attribute
-    mt = [[0] * w_chars for i in range(h_chars)]
+    mt = [0] * cells
     cmu = [0] * 16
 
-    # Attribute map
-    ag = ColourMap(w_chars, h_chars, 4)
-
-    # Set up Commodore 64 palette
-    colourid = (0x000, 0xFFF, 0x931, 0x5BD, 
-                0x93C, 0x4A1, 0x32C, 0xBD3, 
-                0x950, 0x440, 0xC64, 0x444, 
-                0x777, 0x8E5, 0x75F, 0x999)
-
-    iklv, colourid2 = [], []
-    for u in colourid:
-        rlv = u / 256    
-        glv = (u / 16) & 15
-        blv = u & 15
-        iklv.append(((blv * 11) + (glv * 59) + (rlv * 30)) / 15)
-        colourid2.append( ( int((rlv / 15.0) * 255),
-                            int((glv / 15.0) * 255),
-                            int((blv / 15.0) * 255) ) )
-    iklv = tuple(iklv)
-    colourid2 = tuple(colourid2)
+    # Attribute map - 4 colours for each character in reading order
+    ag = array("B", "\x00" * (cells * 4))
 
     # Step 1 - Count number of pixels of each colour in each character square
 
     # Initialise progress bar
     gimp.progress_init("Commodore 64 (Low Res) - Step 1/8")
 
-    for y1 in range(h_chars):
+    # Palette index of each pair of pixels, worked out from the left one a
+    # row at a time, kept as one byte per pair for step 8
+    p_width = w_chars * 4
+    pair = pxl_size * 2
+    plane = array("B")
+    for y in range(h_chars * 8):
+        pos = width * y * pxl_size
+        end = pos + p_width * pair
+        plane.extend(map(nearest.__getitem__, 
+                         map(add, 
+                             map(add, 
+                                 map(red_bits.__getitem__, 
+                                     pxl[pos : end : pair]),
+                                 map(green_bits.__getitem__, 
+                                     pxl[pos + 1 : end : pair])),
+                             map(blue_bits.__getitem__, 
+                                 pxl[pos + 2 : end : pair]))))
+
+    # Count every pair in one pass - each pair's count is at its 
+    # character's counts plus its palette index
+    for y in range(h_chars * 8):
 
         # Update progress bar
-        gimp.progress_update(y1 / float(h_chars))
+        if y % 8 == 0:
+            gimp.progress_update(y / 8 / float(h_chars))
 
-        for x1 in range(w_chars):
-            for y2 in range(8):
-                for x2 in range(4):
-                    x = x2 + (x1 * 4)
-                    y = y2 + (y1 * 8)
-                    dst_pos = ((x * 2) + width * y) * pxl_size
-                    rgba = dst_pxl[dst_pos: dst_pos + pxl_size]
-                    u = 0
-                    dis = 1000
-                    for i, c in enumerate(colourid):
-                        rlv,  glv,  blv = c / 256, (c / 16) & 15, c & 15  
-                        rlv2, glv2, blv2 = [j / 16 % 16 for j in rgba[0:3]]
-
-                        rdist = abs(rlv - rlv2)
-                        gdist = abs(glv - glv2)
-                        bdist = abs(blv - blv2)
-
-                        rgbdist = sqrt((rdist**2)+(gdist**2)+(bdist**2))
-
-                        if rgbdist < dis:
-                            dis = rgbdist
-                            u = i
-            
-                    cr.add_pixel(x1, y1, u)
+        base = w_chars * (y / 8) * 16
+        for cnt in map(add, [base + (x / 4) * 16 for x in range(p_width)], 
+                       plane[p_width * y : p_width * (y + 1)]):
+            cr[cnt] += 1
 
     # Step 2 - Count number of colours used in each character square
 
     # Initialise progress bar
     gimp.progress_init("Commodore 64 (Low Res) - Step 2/8")
 
-    for y1 in range(h_chars):
-
-        # Update progress bar
-        gimp.progress_update(y1 / float(h_chars))
-
-        for x1 in range(w_chars):
-            es = 0
-            for e in range(16):
-                if cr.get_pixel(x1, y1, e) != 0: es += 1
-            mt[y1][x1] = es
+    for cell in range(cells):
+        mt[cell] = 16 - cr[cell * 16 : cell * 16 + 16].count(0)
 
     # Step 3 - Work out most used colours in squares with more than 4 colours
 
     # Initialise progress bar
     gimp.progress_init("Commodore 64 (Low Res) - Step 3/8")
 
-    for y1 in range(h_chars):
-
-        # Update progress bar
-        gimp.progress_update(y1 / float(h_chars))
-
-        for x1 in range(w_chars):
-            if mt[y1][x1] >= 4:
-                for e in range(16):
-                    if cr.get_pixel(x1, y1, e) > 0:
-                        cmu[e] += 1
+    for cell in range(cells):
+        if mt[cell] >= 4:
+            cmu = map(add, cmu, [cnt > 0 for cnt in 
+                                 cr[cell * 16 : cell * 16 + 16]])
 
     # Step 4 - Determine most used colour in squares with more than 4 colours
 
@@ -204,86 +172,58 @@ def c64lo(img, layer):
     # Initialise progress bar
     gimp.progress_init("Commodore 64 (Low Res) - Step 5/8")
 
-    for y1 in range(h_chars):
-
-        # Update progress bar
-        gimp.progress_update(y1 / float(h_chars))
-
-        for x1 in range(w_chars):
-            for g in range(4):
-                ag.set_pixel(x1, y1, g, 16)
-            ag.set_pixel(x1, y1, 0, curc)
-            cr.set_pixel(x1, y1, curc, 0)
+    ag = array("B", [curc, 16, 16, 16] * cells)
+    cr[curc : : 16] = array("B", "\x00" * cells)
 
     # Step 6 - Sets index from 1 to 3 from each attribute with remaining colours
 
     # Initialise progress bar
     gimp.progress_init("Commodore 64 (Low Res) - Step 6/8")
 
-    for y1 in range(h_chars):
+    for cell in range(cells):
 
         # Update progress bar
-        gimp.progress_update(y1 / float(h_chars))
+        if cell % w_chars == 0:
+            gimp.progress_update(cell / w_chars / float(h_chars))
 
-        for x1 in range(w_chars):
-            for g in range(1, 4):
-                mx, ct = 0, 0
-                for e in range(16):
-                    if cr.get_pixel(x1, y1, e) > mx:
-                        ct = e
-                        mx = cr.get_pixel(x1, y1, e)
-                cr.set_pixel(x1, y1, ct, 0)
-                ag.set_pixel(x1, y1, g, ct)
+        # The first of the most used colours left - or 0 if there are none
+        counts = cr[cell * 16 : cell * 16 + 16]
+        for g in range(1, 4):
+            ct = counts.index(max(counts))
+            counts[ct] = 0
+            ag[cell * 4 + g] = ct
 
     # Step 7 - Cleans value 16 generated from Step 5 (becomes background 0)
 
     # Initialise progress bar
     gimp.progress_init("Commodore 64 (Low Res) - Step 7/8")
 
-    for y1 in range(h_chars):
-
-        # Update progress bar
-        gimp.progress_update(y1 / float(h_chars))
-
-        for x1 in range(w_chars):
-            for g in range(1, 4):
-                if ag.get_pixel(x1, y1, g) > 15:
-                    ag.set_pixel(x1, y1, g, ag.get_pixel(0, 0, 0)) 
+    for g in range(1, 4):
+        ag[g : : 4] = array("B", [(c, ag[0])[c > 15] for c in ag[g : : 4]])
             
-    # Step 8 - Create final image
+    # Step 8 - Work out the pixels of each character
 
     # Initialise progress bar
     gimp.progress_init("Commodore 64 (Low Res) - Step 8/8")
 
+    # Bitmap - 8 bytes for each character in reading order, each holding 
+    # 4 pixels of 2 bits, the leftmost in the top bits
+    pke = array("B", "\x00" * (cells * 8))
+
     for y1 in range(h_chars):
 
         # Update progress bar
         gimp.progress_update(y1 / float(h_chars))
 
         for x1 in range(w_chars):
-            kv = [iklv[ag.get_pixel(x1, y1, e)] for e in range(4)]
+            cell = (x1 + w_chars * y1) * 4
+            kv = [iklv[ag[cell + e]] for e in range(4)]
             for y2 in range(8):
                 vac = 0
                 for x2 in range(4):
                     x = (x1 * 4) + x2
                     y = (y1 * 8) + y2
-                    dst_pos = ((x * 2) + width * y) * pxl_size
-                    rgba = dst_pxl[dst_pos: dst_pos + pxl_size]
-                    u, dis = 0, 1000
-                    for i, c in enumerate(colourid):
-                        rlv,  glv,  blv = c / 256, (c / 16) & 15, c & 15  
-                        rlv2, glv2, blv2 = [j / 16 % 16 for j in rgba[0:3]]
-
-                        rdist = abs(rlv - rlv2)
-                        gdist = abs(glv - glv2)
-                        bdist = abs(blv - blv2)
-
-                        rgbdist = sqrt((rdist**2)+(gdist**2)+(bdist**2))
-
-                        if rgbdist < dis:
-                            dis = rgbdist
-                            u = i
-                    kvv = iklv[u]
+                    kvv = iklv[plane[x + p_width * y]]
 
                     diff, vap = 1000, 0
                     for e in range(4):
@@ -291,24 +231,220 @@ def c64lo(img, layer):
                             vap = e
                             diff = abs(kvv - kv[e])
 
-                    rgba = array("B", "\xff" * pxl_size)
-                    c = colourid2[ag.get_pixel(x1, y1, vap)]
-                    rgba[0] = c[0]
-                    rgba[1] = c[1]
-                    rgba[2] = c[2]
+                    vac = vac + (vap * (4 ** (3 - x2)))
+                
+                adrp = (x1 + w_chars * y1) * 8 + y2
+                pke[adrp] = vac
+
+    return ag, pke
+
+def c64_render(ag, pke, cols, rows, pxl_size):
+
+    # Work out each palette colour as a pair of pixels
+    inks = []
+    for r, g, b in colourid2:
+        rgba = array("B", "\xff" * pxl_size)
+        rgba[0], rgba[1], rgba[2] = r, g, b
+        inks.append(rgba.tostring() * 2)
+
+    # Each character's colours and bitmap byte become 8 pixels, worked out
+    # the first time they turn up
+    attrs = ag.tostring()
+    spans = {}
+
+    lines = []
+    for y in range(rows * 8):
+        y1, y2 = y / 8, y % 8
+        for x1 in range(cols):
+            cell = x1 + cols * y1
+            vac = pke[cell * 8 + y2]
+            key = attrs[cell * 4 : cell * 4 + 4] + chr(vac)
+            if key not in spans:
+                spans[key] = "".join([inks[ag[cell * 4 + 
+                                              ((vac >> (6 - x2 * 2)) & 3)]]
+                                      for x2 in range(4)])
+            lines.append(spans[key])
+
+    return "".join(lines)
+
+# The screen is kept with the layer as a parasite - column and row counts,
+# then the attribute map, then the bitmap
+def attach_screen(drawable, cols, rows, ag, pke):
+    data = struct.pack("<II", cols, rows) + ag.tostring() + pke.tostring()
+    drawable.attach_new_parasite("c64-screen",
+                                 (gimp.PARASITE_PERSISTENT | 
+                                  gimp.PARASITE_UNDOABLE), data)
+
+def find_screen(drawable):
+    parasite = drawable.parasite_find("c64-screen")
+    if parasite is None:
+        return None
+    data = parasite.data
+    cols, rows = struct.unpack("<II", data[0:8])
+    ag = array("B", data[8 : 8 + cols * rows * 4])
+    pke = array("B", data[8 + cols * rows * 4 : 8 + cols * rows * 12])
+    return cols, rows, ag, pke
+
+# Most character squares whose screen is kept with a layer - about 770K of
+# parasite, for a 2048 x 2048 image. Bigger images aren't given one, as it
+# would be held in memory and saved with the image.
+parasite_blocks = 256 * 256
+
+def c64_koala(ag, pke, cols, rows):
+
+    # A Koala file holds a full 40 x 25 character screen - the load 
+    # address, the bitmap, screen RAM with the colours for pixel values 1
+    # and 2, colour RAM with the colour for 3, then the background colour 
+    # for 0 - so the screen is cropped or padded with black to fit
+    bitmap = array("B", "\x00" * 8000)
+    screen = array("B", "\x00" * 1000)
+    colour = array("B", "\x00" * 1000)
+    span = min(cols, 40)
+    for y1 in range(min(rows, 25)):
+        pos = cols * y1
+        bitmap[320 * y1 : 320 * y1 + span * 8] = pke[pos * 8 : 
+                                                    (pos + span) * 8]
+        screen[40 * y1 : 40 * y1 + span] = \
+            array("B", [(c1 << 4) | c2 for c1, c2 in 
+                        zip(ag[pos * 4 + 1 : (pos + span) * 4 : 4],
+                            ag[pos * 4 + 2 : (pos + span) * 4 : 4])])
+        colour[40 * y1 : 40 * y1 + span] = ag[pos * 4 + 3 : 
+                                              (pos + span) * 4 : 4]
+
+    # Every character shares the background colour
+    background = 0
+    if len(ag) > 0:
+        background = ag[0]
+
+    return (struct.pack("<H", 0x6000) + bitmap.tostring() + 
+            screen.tostring() + colour.tostring() + chr(background))
+
+def c64_unkoala(data):
+
+    # Put each character's four colours back together
+    background = ord(data[10002]) & 15
+    screen = array("B", data[8002 : 9002])
+    colour = array("B", data[9002 : 10002])
+    ag = array("B", "\x00" * 4000)
+    ag[0 : : 4] = array("B", [background] * 1000)
+    ag[1 : : 4] = array("B", [c >> 4 for c in screen])
+    ag[2 : : 4] = array("B", [c & 15 for c in screen])
+    ag[3 : : 4] = array("B", [c & 15 for c in colour])
+    pke = array("B", data[2 : 8002])
+
+    return ag, pke
+
+def screen_matches(drawable, screen):
+
+    # A screen left with a layer only still holds if the layer shows it -
+    # the layer may have been painted on since
+    cols, rows, ag, pke = screen
+    if (cols, rows) != (drawable.width / 8, drawable.height / 8):
+        return False
+    src_rgn = drawable.get_pixel_rgn(0, 0, cols * 8, rows * 8, False, False)
+    return (c64_render(ag, pke, cols, rows, src_rgn.bpp) == 
+            src_rgn[0:cols * 8, 0:rows * 8])
+
+def drawable_screen(drawable):
+
+    # Use the screen left by the Commodore 64 filter if the layer still 
+    # shows it, otherwise work it out
+    screen = find_screen(drawable)
+    if screen is None or not screen_matches(drawable, screen):
+        width, height = drawable.width, drawable.height
+        src_rgn = drawable.get_pixel_rgn(0, 0, width, height, False, False)
+        src_pxl = array("B", src_rgn[0:width, 0:height])
+        ag, pke = c64_screen(src_pxl, width, height, src_rgn.bpp)
+        screen = (width / 8, height / 8, ag, pke)
+
+    return screen
+
+def save_koa(img, drawable, filename, raw_filename):
+
+    gimp.progress_init(_("Saving %s") % filename)
+    cols, rows, ag, pke = drawable_screen(drawable)
+
+    koa_file = open(filename, "wb")
+    koa_file.write(c64_koala(ag, pke, cols, rows))
+    koa_file.close()
+
+def load_koa(filename, raw_filename):
+
+    koa_file = open(filename, "rb")
+    data = koa_file.read(10003)
+    koa_file.close()
+    if len(data) < 10003:
+        raise IOError(_("%s is too short to be a Koala Painter picture") 
+                      % filename)
+
+    # Colour in the screen as a new image
+    ag, pke = c64_unkoala(data)
+    img = gimp.Image(320, 200, RGB)
+    layer = gimp.Layer(img, _("Background"), 320, 200, 
+                       RGB_IMAGE, 100, NORMAL_MODE)
+    img.add_layer(layer, 0)
+    dst_rgn = layer.get_pixel_rgn(0, 0, 320, 200, True, False)
+    dst_rgn[0:320, 0:200] = c64_render(ag, pke, 40, 25, dst_rgn.bpp)
+    layer.update(0, 0, 320, 200)
+
+    # Keep the screen with the layer so it can be saved again
+    attach_screen(layer, 40, 25, ag, pke)
+    img.filename = filename
+
+    return img
+
+# Each file procedure registers its own handler once it has been installed
+def register_koa_load():
+    gimp.register_load_handler("file-c64koala-load", "koa", "")
+
+def register_koa_save():
+    gimp.register_save_handler("file-c64koala-save", "koa", "")
+
+def c64lo(img, layer):
+
+    # Store the GIMP's settings so they can be restored when we're finished
+    gimp.context_push()
 
-                    dst_pos = ((x * 2) + width * y) * pxl_size
-                    dst_pxl[dst_pos : dst_pos + pxl_size] = rgba                     
+    # Make all the operations in this filter undo in one group
+    img.undo_group_start()
 
-                    dst_pos = (((x * 2) + 1) + width * y) * pxl_size
-                    dst_pxl[dst_pos : dst_pos + pxl_size] = rgba
+    # Set up constants
+    width = img.width
+    height = img.height
 
-                    vac = vac + (vap * (4 ** (3 - x2)))
-                
-                #pke[adrp] = vac
+    # Create a new black layer above the existing one
+    position = pdb.gimp_image_get_layer_position(img, layer)
+    gimp.set_background(0, 0, 0)
+    black_layer = gimp.Layer(img, "Black Layer", width, height, 
+                             RGB_IMAGE, 100, NORMAL_MODE)
+    pdb.gimp_image_add_layer(img, black_layer, position)
+
+    # Create a copy of the image as a new layer above the black one
+    position = pdb.gimp_image_get_layer_position(img, black_layer)
+    new_layer = pdb.gimp_layer_copy(layer, False)
+    pdb.gimp_image_add_layer(img, new_layer, position)
+
+    # Specify the new layer as the pixel region we'll work with
+    dst_rgn = new_layer.get_pixel_rgn(0,            # x
+                                      0,            # y
+                                      width,        # w
+                                      height,       # h
+                                      True,         # dirty
+                                      False )       # shadow
+    
+    # Store the copy of the pixel region in a byte array for speed
+    dst_pxl = array("B", dst_rgn[0:width, 0:height])
 
-    # Copy the byte array back into the pixel region
-    dst_rgn[0:width, 0:height] = dst_pxl.tostring()
+    # Work out colour depth of image
+    pxl_size = dst_rgn.bpp
+
+    # Work out the colours and pixels of every character
+    ag, pke = c64_screen(dst_pxl, width, height, pxl_size)
+
+    # Colour in the characters and copy them back into the pixel region
+    w_chars, h_chars = width / 8, height / 8
+    dst_rgn[0:w_chars * 8, 0:h_chars * 8] = c64_render(ag, pke, w_chars, 
+                                                       h_chars, pxl_size)
 
     # Update the processed layer
     new_layer.update(0, 0, width, height)
@@ -320,6 +456,14 @@ def c64lo(img, layer):
     # Merge black layer into the original
     layer = pdb.gimp_image_merge_down(img, black_layer, CLIP_TO_IMAGE)
 
+    # Keep the screen with the layer so it can be saved as a Koala file,
+    # unless the image is too big for it - a screen left by an earlier run
+    # no longer matches the layer either way
+    if w_chars * h_chars <= parasite_blocks:
+        attach_screen(layer, w_chars, h_chars, ag, pke)
+    elif layer.parasite_find("c64-screen") is not None:
+        layer.parasite_detach("c64-screen")
+
     img.undo_group_end()
     gimp.context_pop()
 
@@ -338,4 +482,40 @@ register("python-fu-c64lo",
          c64lo, 
          menu="<Image>/Filters/Retro Computing",
          domain=("gimp20-python", gimp.locale_directory))
+
+register("file-c64koala-load",
+         N_("Load a Koala Painter picture (.KOA)"),
+         "",
+         "Dave Jeffery",
+         "Dave Jeffery",
+         "2010",
+         N_("Koala Painter picture"),
+         None,
+         [(PF_STRING, "filename", _("The name of the file to load"), None),
+          (PF_STRING, "raw-filename", _("The name entered"), None)
+         ],
+         [(PF_IMAGE, "image", _("Output image"))],
+         load_koa, 
+         on_query=register_koa_load,
+         menu="<Load>",
+         domain=("gimp20-python", gimp.locale_directory))
+
+register("file-c64koala-save",
+         N_("Save as a Koala Painter picture (.KOA)"),
+         "",
+         "Dave Jeffery",
+         "Dave Jeffery",
+         "2010",
+         N_("Koala Painter picture"),
+         "RGB*",
+         [(PF_IMAGE, "image", _("Input image"), None),
+          (PF_DRAWABLE, "drawable", _("Input drawable"), None),
+          (PF_STRING, "filename", _("The name of the file to save"), None),
+          (PF_STRING, "raw-filename", _("The name entered"), None)
+         ],
+         [],
+         save_koa, 
+         on_query=register_koa_save,
+         menu="<Save>",
+         domain=("gimp20-python", gimp.locale_directory))
 main()
@@ -23,12 +23,370 @@
 #   from firstbasic version: 010808
 #   Speed enhancements based on blog post by Joao Bueno and Akkana Peck
 
-from math import sqrt
 from array import array
+from operator import add, le
+import struct
 
 from gimpfu import *
 gettext.install("gimp20-python", gimp.locale_directory, unicode=True)
 
+# Defines greyscale values of MSX1 palette
+grpltlev = (   0,  237,  314,  395, 400, 
+             448,  504,  564,  600, 701,
+             714,  765,  778,  825, 1000)
+grpltlev = tuple([(grd * 255)/1000 for grd in grpltlev])
+
+# Colour palette
+npaletr = (0, 1, 5, 1, 7, 2, 6, 1, 7, 2, 5, 3, 6, 6, 7)
+npaletg = (0, 1, 1, 4, 1, 3, 2, 6, 3, 6, 5, 7, 6, 6, 7)
+npaletb = (0, 7, 1, 1, 1, 7, 5, 1, 3, 7, 5, 3, 1, 4, 7)
+
+npaletr = tuple([(rr * 255) / 7 for rr in npaletr])
+npaletg = tuple([(rg * 255) / 7 for rg in npaletg])
+npaletb = tuple([(rb * 255) / 7 for rb in npaletb])
+
+# For each grey level, the ink and paper combinations a row of that grey
+# can use - those where the grey is lighter than or the same as the 
+# paper's grey tone but darker than the ink's - along with the colour
+# the halftone mixes from them at that grey
+def make_grey_pairs():
+    grey_pairs = []
+    for grayrgb in range(0, 256):
+        pairs = []
+        for pa in range(0, 14):
+            for ik in range (pa + 1, 15):
+                graypa = grpltlev[pa]
+                grayik = grpltlev[ik]
+                if (grayrgb >= graypa) and (grayrgb < grayik):
+                    ikincid = ((grayrgb - graypa) * 255) / (grayik - graypa)
+                    rfikinc=((npaletr[ik] * ikincid) + 
+                             (npaletr[pa] * (255 - ikincid))) / 255
+                    gfikinc=((npaletg[ik] * ikincid) + 
+                             (npaletg[pa] * (255 - ikincid))) / 255
+                    bfikinc=((npaletb[ik] * ikincid) + 
+                             (npaletb[pa] * (255 - ikincid))) / 255
+                    pairs.append((pa, ik, rfikinc, gfikinc, bfikinc))
+        grey_pairs.append(tuple(pairs))
+    return tuple(grey_pairs)
+
+grey_pairs = make_grey_pairs()
+
+# Ink and paper chosen for each row mean colour seen so far, packed as 
+# 0xRRGGBB, so repeated colours in the image skip the search. The GIMP
+# starts the plug-in afresh for every call, so it only lasts for one run.
+row_attr_table = {}
+
+def row_attributes(r, g, b):
+
+    mean = (r << 16) | (g << 8) | b
+    if mean in row_attr_table:
+        return row_attr_table[mean]
+
+    # Work out MSX ink and paper values of row
+    dbuf = 1000 ** 2
+    paattr = 0
+    ikattr = 14
+    lumik = 0
+    lumpa = 1
+
+    # Convert current row's average RGB to grey
+    grayrgb = (((b * 11) + (r * 30) + (g * 59)) / 100)
+
+    # Cycle through the ink and paper combinations that can make this grey,
+    # comparing squared distances - the same order as comparing the
+    # distances themselves
+    for pa, ik, rfikinc, gfikinc, bfikinc in grey_pairs[grayrgb]:
+        rdist = rfikinc - r
+        gdist = gfikinc - g
+        bdist = bfikinc - b
+        rgbdist = (rdist * rdist) + (gdist * gdist) + (bdist * bdist)
+        if rgbdist <= dbuf: 
+            dbuf = rgbdist
+            paattr = pa
+            ikattr = ik
+
+    # Look-up ink and paper values as greys
+    if dbuf < 1000 ** 2:
+        lumik = grpltlev[ikattr]
+        lumpa = grpltlev[paattr]
+
+    row_attr_table[mean] = (paattr, ikattr, lumpa, lumik)
+    return row_attr_table[mean]
+
+# Define two halftone clusters - tuples used for speed
+cluster = ((( 0,  6,  8, 14),
+            ( 2, 12,  4, 10),
+            ( 8, 14,  0,  6),
+            ( 4, 10,  2, 12)),
+           (( 0, 12,  3, 15),
+            ( 8,  4, 11,  7),
+            ( 2, 14,  1, 13),
+            (10,  6,  9,  5)))
+
+# Look-up tables for the grey of a pixel - (b * 11) + (r * 30) + (g * 59),
+# divided by 100 - so a whole row can be converted with map()
+grey_r = tuple([r * 30 for r in range(0, 256)])
+grey_g = tuple([g * 59 for g in range(0, 256)])
+grey_b = tuple([b * 11 for b in range(0, 256)])
+grey_div = tuple([v / 100 for v in range(0, 25501)])
+
+# The bitmap byte for each run of 8 ink (True) and paper (False) pixels
+pattern_bytes = dict([(tuple([(byte & (0x80 >> x2)) != 0 
+                              for x2 in range(0, 8)]), byte)
+                      for byte in range(0, 256)])
+
+def msx_screen(pxl, width, height, pxl_size, halftone):
+
+    # Work out size of image in character squares
+    xmaxo, ymaxo = width / 8, height / 8
+    span = xmaxo * 8 * pxl_size
+
+    # Halftone level of each position in the cluster
+    patgfs = [[((cluster[halftone][y2][x2] + 1) * 255) / 16
+               for x2 in range(0, 4)] for y2 in range(0, 4)]
+
+    # Grey each pixel must reach to be ink, for each paper, ink and row of
+    # the cluster - worked out as needed
+    thresholds = {}
+
+    # The screen - ink in the top 4 bits and paper in the bottom 4 bits of
+    # a colour byte for each row of 8 pixels, and a bitmap byte with ink
+    # pixels set, both in reading order
+    attrs = array("B")
+    bitmap = array("B")
+
+    # Process image one pixel row at a time
+    for y in range(0, ymaxo * 8):
+
+        # Update progress bar
+        if y % 8 == 0:
+            gimp.progress_update(float(y / 8) / ymaxo)
+
+        # Read the row a channel at a time, and convert it all to grey
+        pos = y * width * pxl_size
+        rrow = pxl[pos : pos + span : pxl_size]
+        grow = pxl[pos + 1 : pos + span : pxl_size]
+        brow = pxl[pos + 2 : pos + span : pxl_size]
+        vlues = map(grey_div.__getitem__, 
+                    map(add, map(grey_b.__getitem__, brow),
+                        map(add, map(grey_r.__getitem__, rrow),
+                            map(grey_g.__getitem__, grow))))
+
+        # Work out MSX ink and paper values of each row of 8 pixels, and the
+        # grey each of its pixels must reach to be ink
+        row_levels = []
+        for x in range(0, xmaxo * 8, 8):
+            r = sum(rrow[x : x + 8]) / 8
+            g = sum(grow[x : x + 8]) / 8
+            b = sum(brow[x : x + 8]) / 8
+            paattr, ikattr, lumpa, lumik = row_attributes(r, g, b)
+            attrs.append((ikattr << 4) | paattr)
+
+            key = (paattr, ikattr, y % 4)
+            if key not in thresholds:
+                dflum = lumik - lumpa
+                thresholds[key] = tuple([((patgfs[y % 4][x2 % 4] * dflum) 
+                                          / 255) + lumpa
+                                         for x2 in range(0, 8)])
+            row_levels.extend(thresholds[key])
+
+        # Halftone the whole row at once - a pixel is ink unless its grey
+        # is below the halftone level
+        inks = map(le, row_levels, vlues)
+        bitmap.extend([pattern_bytes[tuple(inks[x : x + 8])]
+                       for x in range(0, xmaxo * 8, 8)])
+
+    return attrs, bitmap
+
+def msx_render(attrs, bitmap, cols, lines, pxl_size):
+
+    # Work out the colour of every palette entry as a pixel
+    colours = []
+    for r, g, b in zip(npaletr, npaletg, npaletb):
+        rgba = array("B", "\xff" * pxl_size)
+        rgba[0], rgba[1], rgba[2] = r, g, b
+        colours.append(rgba.tostring())
+
+    # Each colour and bitmap byte pair becomes 8 pixels, worked out the
+    # first time the pair turns up
+    spans = {}
+
+    line = []
+    for i in range(0, cols * lines):
+        key = (attrs[i] << 8) | bitmap[i]
+        if key not in spans:
+            ink = colours[attrs[i] >> 4]
+            paper = colours[attrs[i] & 15]
+            spans[key] = "".join([ink if bitmap[i] & (0x80 >> x2) else paper
+                                  for x2 in range(0, 8)])
+        line.append(spans[key])
+
+    return "".join(line)
+
+# The screen is kept with the layer as a parasite - column and row counts,
+# then the colour bytes, then the bitmap bytes
+def attach_screen(drawable, cols, rows, attrs, bitmap):
+    data = (struct.pack("<II", cols, rows) + attrs.tostring() + 
+            bitmap.tostring())
+    drawable.attach_new_parasite("msx-screen",
+                                 (gimp.PARASITE_PERSISTENT | 
+                                  gimp.PARASITE_UNDOABLE), data)
+
+def find_screen(drawable):
+    parasite = drawable.parasite_find("msx-screen")
+    if parasite is None:
+        return None
+    data = parasite.data
+    cols, rows = struct.unpack("<II", data[0:8])
+    attrs = array("B", data[8 : 8 + cols * rows * 8])
+    bitmap = array("B", data[8 + cols * rows * 8 : 8 + cols * rows * 16])
+    return cols, rows, attrs, bitmap
+
+# Most character squares whose screen is kept with a layer - about 1M of
+# parasite, for a 2048 x 2048 image. Bigger images aren't given one, as it
+# would be held in memory and saved with the image.
+parasite_blocks = 256 * 256
+
+# TMS9918 colour code of each palette entry - the palette is in grey 
+# order, the MSX numbers its colours 1 to 15 with 0 as transparent
+tms_colours = (1, 4, 6, 12, 8, 5, 13, 2, 9, 7, 14, 3, 10, 11, 15)
+
+# Translation tables between colour bytes with palette entries and colour
+# bytes with TMS9918 colour codes - transparent is loaded as black
+def make_colour_bytes():
+    to_tms = [chr(0x11)] * 256
+    from_tms = [chr(0)] * 256
+    codes = [0] * 16
+    for i in range(0, 15):
+        codes[tms_colours[i]] = i
+    for byte in range(0, 256):
+        if (byte >> 4) < 15 and (byte & 15) < 15:
+            to_tms[byte] = chr((tms_colours[byte >> 4] << 4) | 
+                               tms_colours[byte & 15])
+        from_tms[byte] = chr((codes[byte >> 4] << 4) | codes[byte & 15])
+    return "".join(to_tms), "".join(from_tms)
+
+to_tms, from_tms = make_colour_bytes()
+
+# Start of each pixel row's patterns and colours in video memory - the 
+# screen is split into thirds, each with its own 256 characters of 8 bytes
+sc2_rows = tuple([((y & 0xC0) << 5) | ((y & 0x38) << 5) | (y & 7)
+                  for y in range(0, 192)])
+
+def msx_sc2(attrs, bitmap, cols, rows):
+
+    # A .SC2 file holds a full 32 x 24 character Screen 2 - the pattern 
+    # table at 0x0000, the name table at 0x1800, the sprite attributes at 
+    # 0x1B00 and the colour table at 0x2000 - so the screen is cropped or 
+    # padded with black to fit
+    vram = array("B", "\x00" * 0x3800)
+    vram[0x2000 : 0x3800] = array("B", chr(0x11) * 6144)
+
+    # Every character in a third is used once, in order
+    vram[0x1800 : 0x1B00] = array("B", range(0, 256) * 3)
+
+    # No sprites
+    vram[0x1B00] = 0xD0
+
+    span = min(cols, 32)
+    for y in range(0, min(rows, 24) * 8):
+        pos = cols * y
+        top = sc2_rows[y]
+        vram[top : top + span * 8 : 8] = bitmap[pos : pos + span]
+        vram[0x2000 + top : 0x2000 + top + span * 8 : 8] = \
+            array("B", attrs[pos : pos + span].tostring().translate(to_tms))
+
+    # BSAVE header - identifier, then start, end and run addresses
+    return struct.pack("<BHHH", 0xFE, 0, 0x37FF, 0) + vram.tostring()
+
+def msx_unsc2(data):
+
+    # Put the patterns and colours of each pixel row back into reading 
+    # order, following the name table
+    attrs = array("B")
+    bitmap = array("B")
+    for y1 in range(0, 24):
+        offsets = [((y1 & 0x18) << 8) | (ord(name) << 3)
+                   for name in data[0x1800 + y1 * 32 : 0x1800 + y1 * 32 + 32]]
+        for y2 in range(0, 8):
+            bitmap.fromstring("".join([data[pos + y2] for pos in offsets]))
+            attrs.fromstring("".join([data[0x2000 + pos + y2] 
+                                      for pos in offsets]).translate(from_tms))
+
+    return attrs, bitmap
+
+def screen_matches(drawable, screen):
+
+    # A screen left with a layer only still holds if the layer shows it -
+    # the layer may have been painted on since
+    cols, rows, attrs, bitmap = screen
+    if (cols, rows) != (drawable.width / 8, drawable.height / 8):
+        return False
+    src_rgn = drawable.get_pixel_rgn(0, 0, cols * 8, rows * 8, False, False)
+    return (msx_render(attrs, bitmap, cols, rows * 8, src_rgn.bpp) == 
+            src_rgn[0:cols * 8, 0:rows * 8])
+
+def drawable_screen(drawable):
+
+    # Use the screen left by the MSX filter if the layer still shows it, 
+    # otherwise work it out with the first halftone cluster
+    screen = find_screen(drawable)
+    if screen is None or not screen_matches(drawable, screen):
+        width, height = drawable.width, drawable.height
+        src_rgn = drawable.get_pixel_rgn(0, 0, width, height, False, False)
+        src_pxl = array("B", src_rgn[0:width, 0:height])
+        attrs, bitmap = msx_screen(src_pxl, width, height, src_rgn.bpp, 0)
+        screen = (width / 8, height / 8, attrs, bitmap)
+
+    return screen
+
+def save_sc2(img, drawable, filename, raw_filename):
+
+    gimp.progress_init(_("Saving %s") % filename)
+    cols, rows, attrs, bitmap = drawable_screen(drawable)
+
+    sc2_file = open(filename, "wb")
+    sc2_file.write(msx_sc2(attrs, bitmap, cols, rows))
+    sc2_file.close()
+
+def load_sc2(filename, raw_filename):
+
+    sc2_file = open(filename, "rb")
+    data = sc2_file.read()
+    sc2_file.close()
+
+    # Lay the file out as video memory from its start address
+    if len(data) < 7 or data[0] != "\xfe":
+        raise IOError(_("%s is not a BSAVE file") % filename)
+    start = struct.unpack("<H", data[1:3])[0]
+    vram = "\x00" * start + data[7:]
+    if len(vram) < 0x3800:
+        raise IOError(_("%s is too short to be an MSX Screen 2 image") 
+                      % filename)
+
+    # Colour in the screen as a new image
+    attrs, bitmap = msx_unsc2(vram)
+    img = gimp.Image(256, 192, RGB)
+    layer = gimp.Layer(img, _("Background"), 256, 192, 
+                       RGB_IMAGE, 100, NORMAL_MODE)
+    img.add_layer(layer, 0)
+    dst_rgn = layer.get_pixel_rgn(0, 0, 256, 192, True, False)
+    dst_rgn[0:256, 0:192] = msx_render(attrs, bitmap, 32, 192, dst_rgn.bpp)
+    layer.update(0, 0, 256, 192)
+
+    # Keep the screen with the layer so it can be saved again
+    attach_screen(layer, 32, 24, attrs, bitmap)
+    img.filename = filename
+
+    return img
+
+# Each file procedure registers its own handler once it has been installed
+def register_sc2_load():
+    gimp.register_load_handler("file-msxsc2-load", "sc2", "")
+
+def register_sc2_save():
+    gimp.register_save_handler("file-msxsc2-save", "sc2", "")
+
 def msx2(img, layer, halftone):
 
     # Store the GIMP's settings so they can be restored when we're finished
@@ -67,155 +425,17 @@ def msx2(img, layer, halftone):
     # Work out colour depth of image
     pxl_size = dst_rgn.bpp
 
-    # Store for R,G,B in character square
-    r0 = [[0] * 8 for i in range(8)]
-    g0 = [[0] * 8 for i in range(8)]
-    b0 = [[0] * 8 for i in range(8)]
-
-    # Define two halftone clusters - tuples used for speed
-    cluster = ((( 0,  6,  8, 14),
-                ( 2, 12,  4, 10),
-                ( 8, 14,  0,  6),
-                ( 4, 10,  2, 12)),
-               (( 0, 12,  3, 15),
-                ( 8,  4, 11,  7),
-                ( 2, 14,  1, 13),
-                (10,  6,  9,  5)))
-
-    # Defines greyscale values of MSX1 palette
-    grpltlev = (   0,  237,  314,  395, 400, 
-                 448,  504,  564,  600, 701,
-                 714,  765,  778,  825, 1000)
-    grpltlev = tuple([(grd * 255)/1000 for grd in grpltlev])
-
-    # Colour palette
-    npaletr = (0, 1, 5, 1, 7, 2, 6, 1, 7, 2, 5, 3, 6, 6, 7)
-    npaletg = (0, 1, 1, 4, 1, 3, 2, 6, 3, 6, 5, 7, 6, 6, 7)
-    npaletb = (0, 7, 1, 1, 1, 7, 5, 1, 3, 7, 5, 3, 1, 4, 7)
-
-    npaletr = tuple([(rr * 255) / 7 for rr in npaletr])
-    npaletg = tuple([(rg * 255) / 7 for rg in npaletg])
-    npaletb = tuple([(rb * 255) / 7 for rb in npaletb])
-
     # Round screen extent to character blocks
     xmax, ymax = width, height
     xmaxo, ymaxo = xmax / 8, ymax / 8
 
-    # Copy palette
-    rfromat = npaletr[:]
-    gfromat = npaletg[:]
-    bfromat = npaletb[:]
-
-    # Initialise progress bar
+    # Work out the ink, paper and pixels of every row of 8 pixels
     gimp.progress_init("MSX1 (Screen2) Image Filter")
+    attrs, bitmap = msx_screen(dst_pxl, width, height, pxl_size, halftone)
 
-    # Process image one character row at a time
-    for y1 in range(0, ymaxo):
-
-        # Update progress bar
-        gimp.progress_update(float(y1) / ymaxo)
-
-        # Process image one character square at a time
-        for x1 in range(0, xmaxo):
-
-            # Store value of each pixel in character square
-            for y2 in range(0, 8):
-                for x2 in range (0, 8):
-                    y = y1 * 8 + y2
-                    x = x1 * 8 + x2
-
-                    dst_pos = (x + width * y) * pxl_size
-                    rgba = dst_pxl[dst_pos: dst_pos + pxl_size]
-                    b0[y2][x2] = rgba[2]
-                    g0[y2][x2] = rgba[1]
-                    r0[y2][x2] = rgba[0]
-
-            # Find colour attributes for each row of 8 pixels
-            for y2 in range(0, 8):
-                y = y1 * 8 + y2
-
-                # Read each pixel in row
-                bi, ri, gi = 0, 0, 0
-                for x2 in range(0, 8):
-                    x = (x1 * 8) + x2
-                    iy = (ymax - 1) - y
-                    bi = bi + b0[y2][x2]
-                    gi = gi + g0[y2][x2]
-                    ri = ri + r0[y2][x2]
-
-                # Find average RGB values of row
-                b, g, r = bi / 8, gi / 8, ri / 8
-
-                # Work out MSX ink and paper values of row
-                dbuf = 1000
-                paattr = 0
-                ikattr = 14
-                pa = 0
-                ik = 14   
-                lumik = 0
-                lumpa = 1
-
-                # Cycle through all possible ink and paper combinations
-                for pa in range(0, 14):
-                    for ik in range (pa + 1, 15):
-                        # Look-up ink and paper values as greys
-                        graypa = grpltlev[pa]
-                        grayik = grpltlev[ik]
-
-                        # Convert current row's average RGB to grey
-                        grayrgb = (((b * 11) + (r * 30) + (g * 59)) / 100)
-
-                        # If the current row's average grey tone is lighter  
-                        # than the paper's grey tone but darker than the ink's
-                        # grey tone...
-                        if (grayrgb >= graypa) and (grayrgb < grayik):
-                            ikincid = ((grayrgb - graypa) 
-                                       * 255) / (grayik - graypa)
-                            rfikinc=((rfromat[ik] * ikincid) + 
-                                     (rfromat[pa] * (255 - ikincid))) / 255
-                            gfikinc=((gfromat[ik] * ikincid) + 
-                                     (gfromat[pa] * (255 - ikincid))) / 255
-                            bfikinc=((bfromat[ik] * ikincid) + 
-                                     (bfromat[pa] * (255 - ikincid))) / 255
-                            rdist = abs(rfikinc - r)
-                            gdist = abs(gfikinc - g)
-                            bdist = abs(bfikinc - b)                         
-                            rgbdist = sqrt((rdist ** 2) + 
-                                           (gdist ** 2) + 
-                                           (bdist ** 2))
-                            if rgbdist <= dbuf: 
-                                dbuf = rgbdist
-                                paattr = pa
-                                ikattr = ik
-                                lumik = grayik
-                                lumpa = graypa
-
-                # memory block 4 reading as grayscale for screen 2
-                dflum = lumik - lumpa
-                pkvar = 0
-                for x2 in range(0, 8):
-                    x = x1 * 8 + x2
-                    b = b0[y2][x2]
-                    g = g0[y2][x2]
-                    r = r0[y2][x2]
-                    vlue=(((b * 11) + (r * 30) + (g * 59)) / 100)
-                    patgf1 = x2 % 4
-                    patgf2 = y % 4
-                    patgf = (((cluster[halftone][patgf2][patgf1] + 1) 
-                              * 255) / 16)
-                    varnd = ((patgf * dflum) / 255) + lumpa
-                    ik = ikattr
-                    if varnd > vlue:
-                        ik = paattr
-                    dst_pos = (x + width * y) * pxl_size
-                    rgba = array("B", "\xff" * pxl_size)
-                    rgba[0] = npaletr[ik]
-                    rgba[1] = npaletg[ik]
-                    rgba[2] = npaletb[ik]
-                    dst_pxl[dst_pos : dst_pos + pxl_size] = rgba
-
-    # Copy the byte array back into the pixel region
-    dst_rgn[0:width, 0:height] = dst_pxl.tostring()
+    # Colour in the screen and copy it back into the pixel region
+    dst_rgn[0:xmaxo * 8, 0:ymaxo * 8] = msx_render(attrs, bitmap, xmaxo,
+                                                   ymaxo * 8, pxl_size)
 
     # Update the processed layer
     new_layer.update(0, 0, width, height)
@@ -227,6 +447,14 @@ def msx2(img, layer, halftone):
     # Merge black layer into the original
     layer = pdb.gimp_image_merge_down(img, black_layer, CLIP_TO_IMAGE)
 
+    # Keep the screen with the layer so it can be saved as a .SC2 file,
+    # unless the image is too big for it - a screen left by an earlier run
+    # no longer matches the layer either way
+    if xmaxo * ymaxo <= parasite_blocks:
+        attach_screen(layer, xmaxo, ymaxo, attrs, bitmap)
+    elif layer.parasite_find("msx-screen") is not None:
+        layer.parasite_detach("msx-screen")
+
     img.undo_group_end()
     gimp.context_pop()
 
@@ -249,4 +477,40 @@ register("python-fu-msx1scr2",
          msx2, 
          menu="<Image>/Filters/Retro Computing",
          domain=("gimp20-python", gimp.locale_directory))
+
+register("file-msxsc2-load",
+         N_("Load an MSX Screen 2 image (.SC2)"),
+         "",
+         "Dave Jeffery",
+         "Dave Jeffery",
+         "2010",
+         N_("MSX Screen 2 image"),
+         None,
+         [(PF_STRING, "filename", _("The name of the file to load"), None),
+          (PF_STRING, "raw-filename", _("The name entered"), None)
+         ],
+         [(PF_IMAGE, "image", _("Output image"))],
+         load_sc2, 
+         on_query=register_sc2_load,
+         menu="<Load>",
+         domain=("gimp20-python", gimp.locale_directory))
+
+register("file-msxsc2-save",
+         N_("Save as an MSX Screen 2 image (.SC2)"),
+         "",
+         "Dave Jeffery",
+         "Dave Jeffery",
+         "2010",
+         N_("MSX Screen 2 image"),
+         "RGB*",
+         [(PF_IMAGE, "image", _("Input image"), None),
+          (PF_DRAWABLE, "drawable", _("Input drawable"), None),
+          (PF_STRING, "filename", _("The name of the file to save"), None),
+          (PF_STRING, "raw-filename", _("The name entered"), None)
+         ],
+         [],
+         save_sc2, 
+         on_query=register_sc2_save,
+         menu="<Save>",
+         domain=("gimp20-python", gimp.locale_directory))
 main()
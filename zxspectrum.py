@@ -23,11 +23,697 @@
 #   Speed enhancements based on blog post by Joao Bueno and Akkana Peck
 
 from array import array
+import os
+import struct
+import zlib
+from itertools import compress, imap
+from operator import add, le
 
 from gimpfu import *
 gettext.install("gimp20-python", gimp.locale_directory, unicode=True)
 
-def zxspectrum(img, layer, hbedge, rgbsat, halftone):
+# ZX Spectrum palette - blue in the top byte, red in the bottom byte
+plte = (0x000000, 0xB40000, 0x0000B4, 0xB400B4,
+        0x00B400, 0xB4B400, 0x00B4B4, 0xB4B4B4,
+        0x000000, 0xFF0000, 0x0000FF, 0xFF00FF,
+        0x00FF00, 0xFFFF00, 0x00FFFF, 0xFFFFFF)
+
+# Define two halftone clusters - tuples used for speed
+cluster = ((( 0,  6,  8, 14),
+            ( 2, 12,  4, 10),
+            ( 8, 14,  0,  6),
+            ( 4, 10,  2, 12)),
+           (( 0, 12,  3, 15),
+            ( 8,  4, 11,  7),
+            ( 2, 14,  1, 13),
+            (10,  6,  9,  5)))
+
+# Palettes the screen can be coloured in with
+palettes = ((N_("ZX Spectrum"), plte),
+            (N_("Emulator (D7)"),
+             (0x000000, 0xD70000, 0x0000D7, 0xD700D7,
+              0x00D700, 0xD7D700, 0x00D7D7, 0xD7D7D7,
+              0x000000, 0xFF0000, 0x0000FF, 0xFF00FF,
+              0x00FF00, 0xFFFF00, 0x00FFFF, 0xFFFFFF)),
+            (N_("Black and white TV"),
+             tuple([(((c & 7) + ((c & 6) / 2)) * (0xB4, 0xFF)[c / 8] / 10)
+                    * 0x010101 for c in range(16)])))
+
+def block_means(pxl, width, height, pxl_size):
+
+    # Work out size of image in character squares
+    cols = width / 8
+    rows = height / 8
+    span = cols * 8 * pxl_size
+
+    # Mean r, g and b value of each character square, in reading order
+    means = (array("B"), array("B"), array("B"))
+
+    for y1 in range(0, rows):
+        row_pos = [(y1 * 8 + y2) * width * pxl_size for y2 in range(0, 8)]
+
+        for c in range(0, 3):
+            # Sum each pixel column of the character row in one go...
+            col_sums = map(sum, zip(*[pxl[pos + c : pos + span : pxl_size]
+                                      for pos in row_pos]))
+
+            # ...then each run of 8 column sums is a character square
+            means[c].extend([sum(col_sums[x : x + 8]) / 64
+                             for x in range(0, cols * 8, 8)])
+
+    return means
+
+def zx_attributes(r, g, b, hbedge, rgbsat):
+
+    # r, g and b saturation levels    
+    rgrsp = rgbsat
+    ggrsp = rgbsat
+    bgrsp = rgbsat 
+
+    # Work out if character square is "half bright"
+    xrreg = 0
+    hbrite = 0
+    if (r < hbedge) and (g < hbedge) and (b < hbedge):
+        hbrite = 1
+    hbampl = 255 - (hbrite * (255 - hbedge))
+
+    if b > hbampl / 2:
+        b = hbampl - b
+        xrreg = xrreg | 1
+
+    if r > hbampl / 2:
+        r = hbampl - r
+        xrreg=xrreg | 2
+
+    if g > hbampl / 2:
+        g = hbampl - g
+        xrreg = xrreg | 4
+
+    halbr = (r * rgrsp) / 100
+    halbg = (g * ggrsp) / 100
+    halbb = (b * bgrsp) / 100
+
+    vlik = 7
+    if((r > halbb) and (g <= halbb)) or ((b <= halbr) and (g <= halbr)):
+        vlik = 3
+    if((g > halbb) and (r<=halbb)) or ((b <= halbg) and(r <= halbg)):
+        vlik = 5
+    if((g > halbr) and (b<=halbr)) or ((r<=halbg) and (b <= halbg)):
+        vlik = 6
+    if((r <= halbb) and(g<=halbb)):
+        vlik = 1
+    if((b <= halbr) and (g<=halbr)):
+        vlik = 2
+    if((b <= halbg) and (r <= halbg)):
+        vlik = 4
+
+    # Set ink, paper and bright attributes for character square
+    brattr = 1 - hbrite
+    ikattr = (vlik ^ xrreg) # ^ is used for xor
+    paattr = xrreg
+
+    if ikattr < paattr:
+        ikattr, paattr = paattr, ikattr
+
+    return ikattr, paattr, brattr
+
+def grey_levels(ikattr, paattr, brattr, hbedge):
+
+    # Grey levels of the paper and ink, as the halftone sees them
+    ikval = ikattr + ((ikattr & 6) / 2)
+    paval = paattr + ((paattr & 6) / 2)
+
+    lumik = (ikval * 255) / 10
+    lumpa = (paval * 255) / 10
+
+    if brattr < 1:
+        lumik = (lumik * hbedge) / 255
+        lumpa = (lumpa * hbedge) / 255
+
+    return lumpa, lumik
+
+# Tables for working on a character square's 64 pixels at once - each
+# channel value scaled for the grey level, every grey level sum divided by
+# 10, each value squared, and the g and b values shifted so a pixel's r, g
+# and b pack into one number with a count of 1 above them. Summing packed
+# pixels totals their channels and counts them in one go.
+grey_r = [r * 3 for r in range(0, 256)]
+grey_g = [g * 6 for g in range(0, 256)]
+tenths = [v / 10 for v in range(0, 2551)]
+squares = [v * v for v in range(0, 256)]
+pack_g = [g << 14 for g in range(0, 256)]
+pack_b = [(b << 28) | (1 << 42) for b in range(0, 256)]
+
+# Weight of each of a character square's 64 pixels in its 8 bitmap bytes,
+# taken as one number with the top row in the top byte
+bitmap_weights = [(0x80 >> x2) << (8 * (7 - y2)) 
+                  for y2 in range(0, 8) for x2 in range(0, 8)]
+
+# Numbers for scoring a square solid in each palette colour, given its sums
+# of r, g and b and of their squares - twice r, g and b, then 64 times the
+# sum of their squares
+solid_scores = [(2 * (c & 0xFF), 2 * ((c >> 8) & 0xFF), 2 * (c >> 16),
+                 64 * ((c & 0xFF) ** 2 + ((c >> 8) & 0xFF) ** 2 + 
+                       (c >> 16) ** 2)) for c in plte]
+
+# Every ink, paper and bright combination for each (hbedge, halftone)
+# setting, with the palette colours of its paper and ink, the level each of
+# a character square's 64 pixels must reach to be put in the ink colour,
+# and how each pixel moved from paper to ink changes the score - by a
+# constant, plus a multiple of each of its r, g and b values. Combinations
+# with the same ink and paper are kept apart from the pairs of colours.
+combo_tables = {}
+
+def attribute_combos(hbedge, halftone):
+    if (hbedge, halftone) not in combo_tables:
+        patgfs = [((cluster[halftone][y2 & 3][x2 & 3] + 1) * 255) / 16
+                  for y2 in range(0, 8) for x2 in range(0, 8)]
+        solids, pairs = [], []
+        for brattr in range(0, 2):
+            for paattr in range(0, 8):
+                for ikattr in range(paattr, 8):
+                    lumpa, lumik = grey_levels(ikattr, paattr, brattr,
+                                               hbedge)
+                    dflum = lumik - lumpa
+                    varnds = [((patgf * dflum) / 255) + lumpa
+                              for patgf in patgfs]
+                    pa = paattr + (8 * brattr)
+                    ik = ikattr + (8 * brattr)
+                    pr, pg, pb, pk = solid_scores[pa]
+                    ir, ig, ib, ikk = solid_scores[ik]
+                    combo = (ikattr, paattr, brattr, pa, ik, varnds,
+                             min(varnds), max(varnds), (ikk - pk) / 64,
+                             pr - ir, pg - ig, pb - ib)
+                    if ikattr == paattr:
+                        solids.append(combo)
+                    else:
+                        pairs.append(combo)
+        combo_tables[(hbedge, halftone)] = (solids, pairs)
+    return combo_tables[(hbedge, halftone)]
+
+def zx_optimal(rrow, grow, brow, solids, pairs):
+
+    # rrow, grow and brow are the r, g and b values of the 64 pixels of a
+    # character square, in reading order. Returns the attributes of the
+    # combination that halftones closest to them, and its bitmap as one
+    # number.
+    vlues = map(tenths.__getitem__, 
+                map(add, map(add, brow, map(grey_r.__getitem__, rrow)), 
+                    map(grey_g.__getitem__, grow)))
+    packed = map(add, map(add, rrow, map(pack_g.__getitem__, grow)), 
+                 map(pack_b.__getitem__, brow))
+    total = sum(packed)
+    rsum, gsum, bsum = total & 0x3FFF, (total >> 14) & 0x3FFF, total >> 28
+    bsum = bsum & 0x3FFF
+    sqsum = (sum(map(squares.__getitem__, rrow)) + 
+             sum(map(squares.__getitem__, grow)) + 
+             sum(map(squares.__getitem__, brow)))
+
+    # Squared distance of the square's pixels from each palette colour
+    totals = [sqsum - (rk * rsum) - (gk * gsum) - (bk * bsum) + kk
+              for rk, gk, bk, kk in solid_scores]
+    vmin, vmax = min(vlues), max(vlues)
+
+    # Score the square in each colour on its own first...
+    dbuf = None
+    for combo in solids:
+        if dbuf is None or totals[combo[3]] < dbuf:
+            dbuf = totals[combo[3]]
+            best = combo
+
+    # ...then halftone it in each pair of colours and score it by how far 
+    # its pixels are from the square's own - the score solid in the paper 
+    # colour, changed by each pixel put in the ink colour. A pair whose 
+    # levels are all above or all at or below the square's greys comes out
+    # as solid paper or solid ink, which can't beat that colour on its own.
+    for combo in pairs:
+        if combo[6] > vmax or combo[7] <= vmin:
+            continue
+        (ikattr, paattr, brattr, pa, ik, varnds, lo, hi, 
+         kk, rk, gk, bk) = combo
+        inked = sum(compress(packed, imap(le, varnds, vlues)))
+        rgbdist = (totals[pa] + (kk * (inked >> 42)) + 
+                   (rk * (inked & 0x3FFF)) + 
+                   (gk * ((inked >> 14) & 0x3FFF)) + 
+                   (bk * ((inked >> 28) & 0x3FFF)))
+        if rgbdist < dbuf:
+            dbuf = rgbdist
+            best = combo
+
+    # The bitmap of the best combination
+    bits = sum(compress(bitmap_weights, map(le, best[5], vlues)))
+
+    return best[0], best[1], best[2], bits
+
+# Classifier results, one table for each (hbedge, rgbsat) setting. Each
+# table maps a block mean packed as 0xRRGGBB to its (ikattr, paattr,
+# brattr) and is filled in as new means turn up. The GIMP starts the
+# plug-in afresh for every call, so the tables only last for one run - they
+# help with repeated colours in an image, the frames of an animation and
+# the redraws of the preview dialog, not with later calls.
+attr_tables = {}
+
+def attribute_table(hbedge, rgbsat):
+    return attr_tables.setdefault((hbedge, rgbsat), {})
+
+def lookup_attributes(attr_table, r, g, b, hbedge, rgbsat):
+
+    # Set ink, paper and bright attributes for character square,
+    # classifying the mean only if it hasn't been seen before
+    mean = (r << 16) | (g << 8) | b
+    if mean not in attr_table:
+        attr_table[mean] = zx_attributes(r, g, b, hbedge, rgbsat)
+    return attr_table[mean]
+
+def block_pixels(pxl, width, pxl_size, x1, y1):
+
+    # The r, g and b values of the 64 pixels of a character square
+    rrow, grow, brow = array("B"), array("B"), array("B")
+    for y2 in range(0, 8):
+        pos = (x1 * 8 + width * (y1 * 8 + y2)) * pxl_size
+        row_end = pos + (8 * pxl_size)
+        rrow.extend(pxl[pos : row_end : pxl_size])
+        grow.extend(pxl[pos + 1 : row_end : pxl_size])
+        brow.extend(pxl[pos + 2 : row_end : pxl_size])
+
+    return rrow, grow, brow
+
+def zx_screen(pxl, width, height, pxl_size, hbedge, rgbsat, halftone, 
+              optimal=0, reuse=None, means=None):
+
+    # Find the mean r, g and b value of every character square at once
+    if means is None:
+        means = block_means(pxl, width, height, pxl_size)
+    rmean, gmean, bmean = means
+
+    # Work out the halftone level of each position in the cluster
+    patgfs = [[((cluster[halftone][y2][x2] + 1) * 255) / 16
+               for x2 in range(4)] for y2 in range(4)]
+
+    # Look-up table of attributes for these settings, or every combination
+    # to score each square against for the best match, and the best match 
+    # of each different square seen so far
+    attr_table = attribute_table(hbedge, rgbsat)
+    if optimal:
+        combos = attribute_combos(hbedge, halftone)
+        best_matches = {}
+
+    # The screen - an attribute byte for each character square and a bitmap
+    # byte for each row of 8 pixels, both in reading order
+    cols, rows = width / 8, height / 8
+    attrs = array("B", "\x00" * (cols * rows))
+    bitmap = array("B", "\x00" * (cols * rows * 8))
+
+    # Start from an earlier screen, keeping the character squares flagged
+    # in keep as they are
+    keep = [False] * (cols * rows)
+    if reuse is not None:
+        attrs[:], bitmap[:], keep = reuse
+
+    # Process image one character row at a time
+    for y1 in range(0, rows):
+
+        # Process image one character square at a time
+        for x1 in range(0, cols):
+
+            blk = x1 + cols * y1
+            if keep[blk]:
+                continue
+
+            # The best match works out the square's bitmap as it goes
+            if optimal:
+                pixels = block_pixels(pxl, width, pxl_size, x1, y1)
+                square = "".join([c.tostring() for c in pixels])
+                if square not in best_matches:
+                    best_matches[square] = zx_optimal(*pixels + combos)
+                ikattr, paattr, brattr, bits = best_matches[square]
+                attrs[blk] = (brattr << 6) | (paattr << 3) | ikattr
+                for y2 in range(0, 8):
+                    bitmap[x1 + cols * (y1 * 8 + y2)] = \
+                        (bits >> (8 * (7 - y2))) & 0xFF
+                continue
+
+            ikattr, paattr, brattr = lookup_attributes(
+                attr_table, rmean[blk], gmean[blk], bmean[blk], 
+                hbedge, rgbsat)
+            attrs[blk] = (brattr << 6) | (paattr << 3) | ikattr
+
+            lumpa, lumik = grey_levels(ikattr, paattr, brattr, hbedge)
+            dflum = lumik - lumpa
+
+            for y2 in range (0, 8):
+                y = y1 * 8 + y2
+
+                # Read the row of 8 pixels a channel at a time
+                pos = (x1 * 8 + width * y) * pxl_size
+                row_end = pos + (8 * pxl_size)
+                rrow = pxl[pos : row_end : pxl_size]
+                grow = pxl[pos + 1 : row_end : pxl_size]
+                brow = pxl[pos + 2 : row_end : pxl_size]
+
+                # Pixels the halftone puts in the ink colour are set
+                patgf = patgfs[y2 & 3]
+                bits = 0
+                for x2 in range (0, 8):
+                    vlue = (brow[x2] + (rrow[x2] * 3) + (grow[x2] * 6)) / 10
+                    varnd = ((patgf[x2 & 3] * dflum) / 255) + lumpa
+                    if varnd <= vlue:
+                        bits = bits | (0x80 >> x2)
+                bitmap[x1 + cols * y] = bits
+
+    return attrs, bitmap
+
+def zx_render(attrs, bitmap, cols, rows, pxl_size, palette=plte):
+
+    # Work out the colour of every palette entry as a pixel
+    colours = []
+    for c in palette:
+        rgba = array("B", "\xff" * pxl_size)
+        rgba[0] = c & 0x0000FF
+        rgba[1] = (c & 0x00FF00) / 256
+        rgba[2] = (c & 0xFF0000) / 65536
+        colours.append(rgba.tostring())
+
+    # Each attribute and bitmap byte pair becomes 8 pixels, worked out the
+    # first time the pair turns up
+    spans = {}
+
+    lines = []
+    for y in range(0, rows * 8):
+        y1 = y / 8
+        for x1 in range(0, cols):
+            attr = attrs[x1 + cols * y1]
+            bits = bitmap[x1 + cols * y]
+            key = (attr << 8) | bits
+            if key not in spans:
+                bright = (attr >> 3) & 8
+                ink = colours[(attr & 7) + bright]
+                paper = colours[((attr >> 3) & 7) + bright]
+                spans[key] = "".join([ink if bits & (0x80 >> x2) else paper
+                                      for x2 in range(0, 8)])
+            lines.append(spans[key])
+
+    return "".join(lines)
+
+# The screen is kept with the layer as a parasite - column and row counts,
+# then the attribute bytes, then the bitmap bytes
+def attach_screen(drawable, cols, rows, attrs, bitmap):
+    data = (struct.pack("<II", cols, rows) + attrs.tostring() + 
+            bitmap.tostring())
+    drawable.attach_new_parasite("zx-screen",
+                                 (gimp.PARASITE_PERSISTENT | 
+                                  gimp.PARASITE_UNDOABLE), data)
+
+def find_screen(drawable):
+    parasite = drawable.parasite_find("zx-screen")
+    if parasite is None:
+        return None
+    data = parasite.data
+    cols, rows = struct.unpack("<II", data[0:8])
+    attrs = array("B", data[8 : 8 + cols * rows])
+    bitmap = array("B", data[8 + cols * rows : 8 + cols * rows * 9])
+    return cols, rows, attrs, bitmap
+
+# Start of each pixel row in a .SCR file - the screen is split into thirds,
+# and within a third the rows are stored by pixel line within the character
+# before character row
+scr_rows = tuple([((y & 0xC0) << 5) | ((y & 7) << 8) | ((y & 0x38) << 2)
+                  for y in range(0, 192)])
+
+def zx_scr(attrs, bitmap, cols, rows):
+
+    # A .SCR file holds a full 32 x 24 character screen, so the screen is 
+    # cropped or padded with black to fit
+    scr = array("B", "\x00" * 6912)
+    span = min(cols, 32)
+    for y in range(0, min(rows, 24) * 8):
+        pos = cols * y
+        scr[scr_rows[y] : scr_rows[y] + span] = bitmap[pos : pos + span]
+    for y1 in range(0, min(rows, 24)):
+        pos = cols * y1
+        scr[6144 + (32 * y1) : 6144 + (32 * y1) + span] = \
+            attrs[pos : pos + span]
+
+    return scr.tostring()
+
+def zx_unscr(data):
+
+    # Put the pixel rows back into reading order
+    bitmap = array("B")
+    for y in range(0, 192):
+        bitmap.fromstring(data[scr_rows[y] : scr_rows[y] + 32])
+    attrs = array("B", data[6144 : 6912])
+
+    return attrs, bitmap
+
+def screen_matches(drawable, screen):
+
+    # A screen left with a layer only still holds if the layer shows it, in
+    # one of the palettes it can be coloured in with - the layer may have
+    # been painted on since
+    cols, rows, attrs, bitmap = screen
+    if (cols, rows) != (drawable.width / 8, drawable.height / 8):
+        return False
+    src_rgn = drawable.get_pixel_rgn(0, 0, cols * 8, rows * 8, False, False)
+    src_str = src_rgn[0:cols * 8, 0:rows * 8]
+    for name, palette in palettes:
+        if zx_render(attrs, bitmap, cols, rows, src_rgn.bpp, 
+                     palette) == src_str:
+            return True
+    return False
+
+def drawable_screen(drawable):
+
+    # Use the screen left by the ZX Spectrum filter if the layer still shows
+    # it, otherwise work it out with the filter's default settings
+    screen = find_screen(drawable)
+    if screen is None or not screen_matches(drawable, screen):
+        width, height = drawable.width, drawable.height
+        src_rgn = drawable.get_pixel_rgn(0, 0, width, height, False, False)
+        src_pxl = array("B", src_rgn[0:width, 0:height])
+        attrs, bitmap = zx_screen(src_pxl, width, height, src_rgn.bpp,
+                                  180, 30, 0)
+        screen = (width / 8, height / 8, attrs, bitmap)
+
+    return screen
+
+def save_scr(img, drawable, filename, raw_filename):
+
+    gimp.progress_init(_("Saving %s") % filename)
+    cols, rows, attrs, bitmap = drawable_screen(drawable)
+
+    scr_file = open(filename, "wb")
+    scr_file.write(zx_scr(attrs, bitmap, cols, rows))
+    scr_file.close()
+
+def zx_tiles(attrs, bitmap, cols, rows):
+
+    # Each different character square becomes a tile - its 8 bitmap bytes
+    # then its attribute byte - and the map gives the tile for each square
+    # in reading order
+    tiles = []
+    tile_index = {}
+    cellmap = array("H")
+    for y1 in range(0, rows):
+        for x1 in range(0, cols):
+            pos = x1 + cols * y1 * 8
+            tile = (bitmap[pos : pos + cols * 8 : cols].tostring() + 
+                    chr(attrs[x1 + cols * y1]))
+            if tile not in tile_index:
+                if len(tiles) > 0xFFFF:
+                    raise ValueError(_("Too many different character "
+                                       "squares for a tile map"))
+                tile_index[tile] = len(tiles)
+                tiles.append(tile)
+            cellmap.append(tile_index[tile])
+
+    return "".join(tiles), cellmap
+
+def save_tiles(img, drawable, filename, raw_filename):
+
+    gimp.progress_init(_("Saving %s") % filename)
+    cols, rows, attrs, bitmap = drawable_screen(drawable)
+    tiles, cellmap = zx_tiles(attrs, bitmap, cols, rows)
+
+    # The tiles go in the file itself, 9 bytes each...
+    tiles_file = open(filename, "wb")
+    tiles_file.write(tiles)
+    tiles_file.close()
+
+    # ...and the map alongside it - columns and rows, then a tile number
+    # for each square, all little-endian 16-bit values
+    map_file = open(os.path.splitext(filename)[0] + ".map", "wb")
+    map_file.write(struct.pack("<HH", cols, rows))
+    map_file.write(struct.pack("<%dH" % len(cellmap), *cellmap))
+    map_file.close()
+
+def load_scr(filename, raw_filename):
+
+    scr_file = open(filename, "rb")
+    data = scr_file.read(6912)
+    scr_file.close()
+    if len(data) < 6912:
+        raise IOError(_("%s is too short to be a ZX Spectrum screen") 
+                      % filename)
+
+    # Colour in the screen as a new image
+    attrs, bitmap = zx_unscr(data)
+    img = gimp.Image(256, 192, RGB)
+    layer = gimp.Layer(img, _("Background"), 256, 192, 
+                       RGB_IMAGE, 100, NORMAL_MODE)
+    img.add_layer(layer, 0)
+    dst_rgn = layer.get_pixel_rgn(0, 0, 256, 192, True, False)
+    dst_rgn[0:256, 0:192] = zx_render(attrs, bitmap, 32, 24, dst_rgn.bpp)
+    layer.update(0, 0, 256, 192)
+
+    # Keep the screen with the layer so it can be coloured in or saved again
+    attach_screen(layer, 32, 24, attrs, bitmap)
+    img.filename = filename
+
+    return img
+
+# Each file procedure registers its own handler once it has been installed
+def register_scr_load():
+    gimp.register_load_handler("file-zxscr-load", "scr", "")
+
+def register_scr_save():
+    gimp.register_save_handler("file-zxscr-save", "scr", "")
+
+def register_tiles_save():
+    gimp.register_save_handler("file-zxtiles-save", "zxt", "")
+
+def block_hashes(pxl, width, height, pxl_size):
+
+    # Checksum of each character square's pixels, in reading order
+    cols, rows = width / 8, height / 8
+    span = 8 * pxl_size
+    hashes = array("i")
+    for y1 in range(0, rows):
+        row_pos = [(y1 * 8 + y2) * width * pxl_size for y2 in range(0, 8)]
+        for x1 in range(0, cols):
+            crc = 0
+            for pos in row_pos:
+                crc = zlib.crc32(buffer(pxl, pos + x1 * span, span), crc)
+            hashes.append(crc)
+
+    return hashes
+
+class ZXFrames(object):
+
+    # Converts a sequence of frames of the same size, only working out again
+    # the character squares that have changed since they were last worked 
+    # out. A square is unchanged if its checksum is the same, or if its mean 
+    # colour has moved by no more than threshold in each of r, g and b. When
+    # at least scene_cut percent of the squares change, it is taken to be a 
+    # new scene and the whole frame is worked out again.
+
+    def __init__(self, width, height, pxl_size, hbedge, rgbsat, halftone,
+                 optimal=0, threshold=0, scene_cut=50):
+        self.width = width
+        self.height = height
+        self.pxl_size = pxl_size
+        self.settings = (hbedge, rgbsat, halftone, optimal)
+        self.threshold = threshold
+        self.scene_cut = scene_cut
+        self.screen = None
+
+    def frame(self, pxl):
+        width, height, pxl_size = self.width, self.height, self.pxl_size
+        hashes = block_hashes(pxl, width, height, pxl_size)
+        means = block_means(pxl, width, height, pxl_size)
+
+        reuse = None
+        if self.screen is not None:
+            # Compare each square with the frame it was last worked out from
+            threshold = self.threshold
+            old_hashes, old_means = self.hashes, self.means
+            keep = [h == old_h for h, old_h in zip(hashes, old_hashes)]
+            for blk in range(0, len(keep)):
+                if threshold and not keep[blk]:
+                    keep[blk] = max([abs(means[c][blk] - old_means[c][blk])
+                                     for c in range(0, 3)]) <= threshold
+
+            changed = keep.count(False)
+            if changed * 100 < self.scene_cut * len(keep):
+                reuse = self.screen + (keep,)
+
+        hbedge, rgbsat, halftone, optimal = self.settings
+        attrs, bitmap = zx_screen(pxl, width, height, pxl_size, hbedge, 
+                                  rgbsat, halftone, optimal, reuse, means)
+
+        # Squares worked out this time become the reference for later frames
+        if reuse is None:
+            self.hashes, self.means = hashes, means
+        else:
+            for blk, kept in enumerate(reuse[2]):
+                if not kept:
+                    self.hashes[blk] = hashes[blk]
+                    for c in range(0, 3):
+                        self.means[c][blk] = means[c][blk]
+        self.screen = (attrs, bitmap)
+
+        return attrs, bitmap
+
+# Largest tile worked on at once, in pixels - a multiple of 8
+tile_size = 256
+
+# Most character squares whose screen is kept with a layer - about 590K of
+# parasite, for a 2048 x 2048 image. Bigger images aren't given one, as it
+# would be held in memory and saved with the image.
+parasite_blocks = 256 * 256
+
+def paste_blocks(data, cols, x1, y1, tcols, tile, lines=1):
+
+    # Put a tcols wide rectangle of character squares into data laid out
+    # cols to a row, with lines rows of data to each character row
+    for i in range(0, len(tile) / tcols):
+        pos = (y1 * lines + i) * cols + x1
+        data[pos : pos + tcols] = tile[i * tcols : (i + 1) * tcols]
+
+def zx_region(dst_rgn, left, top, cols, rows, hbedge, rgbsat, halftone,
+              optimal=0):
+
+    # Work out and colour in the cols x rows character squares from left,
+    # top one tile at a time, so only a tile's pixels are held in memory.
+    # Returns the screen.
+    pxl_size = dst_rgn.bpp
+    attrs = array("B", "\x00" * (cols * rows))
+    bitmap = array("B", "\x00" * (cols * rows * 8))
+
+    tile_cols = tile_size / 8
+    tiles = ((cols + tile_cols - 1) / tile_cols) * ((rows + tile_cols - 1) 
+                                                    / tile_cols)
+    done = 0
+
+    for y1 in range(0, rows, tile_cols):
+        for x1 in range(0, cols, tile_cols):
+
+            # Update progress bar
+            gimp.progress_update(float(done) / tiles)
+            done += 1
+
+            tcols = min(tile_cols, cols - x1)
+            trows = min(tile_cols, rows - y1)
+            x, y = left + x1 * 8, top + y1 * 8
+            w, h = tcols * 8, trows * 8
+
+            tile_pxl = array("B", dst_rgn[x : x + w, y : y + h])
+            tile_attrs, tile_bitmap = zx_screen(tile_pxl, w, h, pxl_size,
+                                                hbedge, rgbsat, halftone,
+                                                optimal)
+            dst_str = zx_render(tile_attrs, tile_bitmap, tcols, trows, 
+                                pxl_size)
+            dst_rgn[x : x + w, y : y + h] = dst_str
+
+            paste_blocks(attrs, cols, x1, y1, tcols, tile_attrs)
+            paste_blocks(bitmap, cols, x1, y1, tcols, tile_bitmap, 8)
+
+    return attrs, bitmap
+
+def zxspectrum(img, layer, hbedge, rgbsat, halftone, optimal=0):
+
+    # The sliders give floats, but the classifier works in whole numbers
+    hbedge, rgbsat = int(hbedge), int(rgbsat)
 
     # Store the GIMP's settings so they can be restored when we're finished
     gimp.context_push()
@@ -58,170 +744,322 @@ def zxspectrum(img, layer, hbedge, rgbsat, halftone):
                                       height,       # h
                                       True,         # dirty
                                       False )       # shadow
-    
-    # Store the copy of the pixel region in a byte array for speed
-    dst_pxl = array("B", dst_rgn[0:width, 0:height])
 
-    # Work out colour depth of image
-    pxl_size = dst_rgn.bpp
+    # Work out and colour in every character square, a tile at a time
+    cols, rows = width / 8, height / 8
+    gimp.progress_init("ZX Spectrum Image Filter")
+    attrs, bitmap = zx_region(dst_rgn, 0, 0, cols, rows, hbedge, rgbsat,
+                              halftone, optimal)
+
+    # Update the processed layer
+    new_layer.update(0, 0, width, height)
+    new_layer.resize(cols * 8, rows * 8, 0, 0)
+
+    # Merge processed layer into black layer
+    black_layer = pdb.gimp_image_merge_down(img, new_layer, CLIP_TO_IMAGE)
+
+    # Merge black layer into the original
+    layer = pdb.gimp_image_merge_down(img, black_layer, CLIP_TO_IMAGE)
 
+    # Keep the screen with the layer so it can be coloured in again, unless
+    # the image is too big for it - a screen left by an earlier run no longer
+    # matches the layer either way
+    if cols * rows <= parasite_blocks:
+        attach_screen(layer, cols, rows, attrs, bitmap)
+    elif layer.parasite_find("zx-screen") is not None:
+        layer.parasite_detach("zx-screen")
 
-    r0 = [[None] * 8 for i in range(8)]
-    g0 = [[None] * 8 for i in range(8)]
-    b0 = [[None] * 8 for i in range(8)]
+    img.undo_group_end()
+    gimp.context_pop()
 
-    plte = (0x000000, 0xB40000, 0x0000B4, 0xB400B4,
-            0x00B400, 0xB4B400, 0x00B4B4, 0xB4B4B4,
-            0x000000, 0xFF0000, 0x0000FF, 0xFF00FF,
-            0x00FF00, 0xFFFF00, 0x00FFFF, 0xFFFFFF)
+def zxbest(img, layer, hbedge, rgbsat, halftone):
 
-    # Define two halftone clusters - tuples used for speed
-    cluster = ((( 0,  6,  8, 14),
-                ( 2, 12,  4, 10),
-                ( 8, 14,  0,  6),
-                ( 4, 10,  2, 12)),
-               (( 0, 12,  3, 15),
-                ( 8,  4, 11,  7),
-                ( 2, 14,  1, 13),
-                (10,  6,  9,  5)))
+    # Score every ink, paper and bright combination for each character
+    # square rather than using the quick classifier
+    zxspectrum(img, layer, hbedge, rgbsat, halftone, 1)
 
-    #- halfbright attr edge -zx32=218, zx32fs=153 , realthing=180?
-    hbedge = 180 
+def zxregion(img, layer, hbedge, rgbsat, halftone, optimal):
 
-    # r, g and b saturation levels    
-    rgrsp = rgbsat
-    ggrsp = rgbsat
-    bgrsp = rgbsat 
+    # The sliders give floats, but the classifier works in whole numbers
+    hbedge, rgbsat = int(hbedge), int(rgbsat)
 
-    # Initialise progress bar
+    gimp.context_push()
+    img.undo_group_start()
+
+    # Work on the character squares the selection touches, or all of them
+    # if there's no selection. They line up with the squares of the full
+    # filter so the region looks just as it will in the finished image.
+    cols, rows = img.width / 8, img.height / 8
+    non_empty, x1, y1, x2, y2 = pdb.gimp_selection_bounds(img)
+    if not non_empty:
+        x1, y1, x2, y2 = 0, 0, cols * 8, rows * 8
+    left, top = x1 / 8, y1 / 8
+    right, bottom = min((x2 + 7) / 8, cols), min((y2 + 7) / 8, rows)
+    if right <= left or bottom <= top:
+        img.undo_group_end()
+        gimp.context_pop()
+        return
+
+    dst_rgn = layer.get_pixel_rgn(left * 8, top * 8, (right - left) * 8,
+                                  (bottom - top) * 8, True, False)
     gimp.progress_init("ZX Spectrum Image Filter")
+    attrs, bitmap = zx_region(dst_rgn, left * 8, top * 8, right - left,
+                              bottom - top, hbedge, rgbsat, halftone, optimal)
+    layer.update(left * 8, top * 8, (right - left) * 8, (bottom - top) * 8)
 
-    # Process image one character row at a time
-    for y1 in range(0, height / 8):
+    # Put the squares worked out into the screen left with the layer by the
+    # full filter, so colouring it in again doesn't undo them. If the rest
+    # of the layer no longer shows that screen it can't be kept.
+    screen = find_screen(layer)
+    if screen is not None:
+        if screen[0:2] == (cols, rows):
+            paste_blocks(screen[2], cols, left, top, right - left, attrs)
+            paste_blocks(screen[3], cols, left, top, right - left, bitmap, 8)
+        if screen_matches(layer, screen):
+            attach_screen(layer, cols, rows, screen[2], screen[3])
+        else:
+            layer.parasite_detach("zx-screen")
+
+    img.undo_group_end()
+    gimp.context_pop()
+
+# Largest preview shown in the preview dialog, in pixels
+preview_width = 512
+preview_height = 384
+
+# Block means and preview sized greys of each drawable previewed, so moving
+# the sliders doesn't mean reading the image again
+preview_sources = {}
+
+def preview_source(drawable):
+
+    if drawable.ID in preview_sources:
+        return preview_sources[drawable.ID]
+
+    # Show each character square at 8, 4, 2 or 1 pixels across, whichever is
+    # the largest that fits in the preview
+    width, height = drawable.width, drawable.height
+    cols, rows = width / 8, height / 8
+    scale = 8
+    while scale > 1 and (cols * scale > preview_width or 
+                         rows * scale > preview_height):
+        scale = scale / 2
+    step = 8 / scale
+
+    # Read the image a character row at a time, finding the block means
+    # and the grey of every step'th pixel
+    src_rgn = drawable.get_pixel_rgn(0, 0, width, height, False, False)
+    pxl_size = src_rgn.bpp
+    means = (array("B"), array("B"), array("B"))
+    vlues = array("B")
+    for y1 in range(0, rows):
+        band = array("B", src_rgn[0 : cols * 8, y1 * 8 : y1 * 8 + 8])
+        for c, mean in enumerate(block_means(band, cols * 8, 8, pxl_size)):
+            means[c].extend(mean)
+        for y2 in range(0, 8, step):
+            pos = y2 * cols * 8 * pxl_size
+            end = pos + cols * 8 * pxl_size
+            rrow = band[pos : end : pxl_size * step]
+            grow = band[pos + 1 : end : pxl_size * step]
+            brow = band[pos + 2 : end : pxl_size * step]
+            vlues.extend([(b + (r * 3) + (g * 6)) / 10 
+                          for r, g, b in zip(rrow, grow, brow)])
+
+    preview_sources[drawable.ID] = (cols, rows, scale, means, vlues)
+    return preview_sources[drawable.ID]
+
+def zx_preview(source, hbedge, rgbsat, halftone):
+
+    # Colour in a preview from a preview_source - only the attribute 
+    # classifier and the halftone are run again
+    cols, rows, scale, means, vlues = source
+    rmean, gmean, bmean = means
+    attr_table = attribute_table(hbedge, rgbsat)
+    patgfs = [[((cluster[halftone][y2][x2] + 1) * 255) / 16
+               for x2 in range(4)] for y2 in range(4)]
+    colours = [chr(c & 0xFF) + chr((c >> 8) & 0xFF) + chr(c >> 16) 
+               for c in plte]
+
+    pw = cols * scale
+    lines = []
+    for y1 in range(0, rows):
+        levels = []
+        for x1 in range(0, cols):
+            blk = x1 + cols * y1
+            ikattr, paattr, brattr = lookup_attributes(
+                attr_table, rmean[blk], gmean[blk], bmean[blk],
+                hbedge, rgbsat)
+            lumpa, lumik = grey_levels(ikattr, paattr, brattr, hbedge)
+            levels.append((lumpa, lumik - lumpa, 
+                           colours[paattr + (8 * brattr)],
+                           colours[ikattr + (8 * brattr)]))
+
+        for y2 in range(0, scale):
+            y = y1 * scale + y2
+            patgf = patgfs[y & 3]
+            vlue_row = vlues[y * pw : (y + 1) * pw]
+            line = []
+            for x in range(0, pw):
+                lumpa, dflum, paper, ink = levels[x / scale]
+                varnd = ((patgf[x & 3] * dflum) / 255) + lumpa
+                if varnd > vlue_row[x]:
+                    line.append(paper)
+                else:
+                    line.append(ink)
+            lines.append("".join(line))
+
+    return "".join(lines)
+
+def zxpreview(img, layer):
+
+    # Only needed for the dialog
+    import gobject
+    import gtk
+
+    source = preview_source(layer)
+    cols, rows, scale = source[0:3]
+    pw, ph = cols * scale, rows * scale
+    if pw == 0 or ph == 0:
+        gimp.message(_("The image is too small to preview."))
+        return
+
+    dialog = gtk.Dialog(_("ZX Spectrum Preview"), None, 0,
+                        (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL,
+                         gtk.STOCK_OK, gtk.RESPONSE_OK))
+    image = gtk.Image()
+    dialog.vbox.pack_start(image, False, False, 6)
+
+    table = gtk.Table(3, 2)
+    dialog.vbox.pack_start(table, False, False, 6)
+    hbedge = gtk.Adjustment(180, 0, 255, 1, 10, 0)
+    rgbsat = gtk.Adjustment(30, 0, 255, 1, 10, 0)
+    halftone = gtk.combo_box_new_text()
+    halftone.append_text(_("One"))
+    halftone.append_text(_("Two"))
+    halftone.set_active(0)
+    for row, (label, widget) in enumerate((
+            (_("Bright attribute at"), gtk.HScale(hbedge)),
+            (_("RGB saturation point"), gtk.HScale(rgbsat)),
+            (_("Halftone cluster"), halftone))):
+        table.attach(gtk.Label(label), 0, 1, row, row + 1, gtk.FILL)
+        table.attach(widget, 1, 2, row, row + 1)
+        if isinstance(widget, gtk.HScale):
+            widget.set_digits(0)
+
+    def settings():
+        return (int(hbedge.get_value()), int(rgbsat.get_value()),
+                halftone.get_active())
+
+    # Redraw once the sliders stop moving rather than for every step
+    pending = []
+
+    def redraw():
+        del pending[:]
+        rgb = zx_preview(source, *settings())
+        image.set_from_pixbuf(gtk.gdk.pixbuf_new_from_data(
+            rgb, gtk.gdk.COLORSPACE_RGB, False, 8, pw, ph, pw * 3))
+        return False
+
+    def changed(*args):
+        if not pending:
+            pending.append(gobject.idle_add(redraw))
+
+    for adjustment in (hbedge, rgbsat):
+        adjustment.connect("value-changed", changed)
+    halftone.connect("changed", changed)
+
+    redraw()
+    dialog.show_all()
+    response = dialog.run()
+    chosen = settings()
+    dialog.destroy()
+
+    # Run the filter for real with the settings chosen
+    if response == gtk.RESPONSE_OK:
+        zxspectrum(img, layer, *chosen)
+        gimp.displays_flush()
+
+def zxanimation(img, layer, hbedge, rgbsat, halftone, optimal, threshold):
+
+    # The sliders give floats, but the classifier works in whole numbers
+    hbedge, rgbsat, threshold = int(hbedge), int(rgbsat), int(threshold)
+
+    gimp.context_push()
+    img.undo_group_start()
+
+    # Each layer is a frame, starting with the bottom one
+    frames = img.layers[::-1]
+    coder = None
+
+    # Initialise progress bar
+    gimp.progress_init("ZX Spectrum Animation Filter")
+
+    for i, frame in enumerate(frames):
 
         # Update progress bar
-        gimp.progress_update(float(y1) / (height / 8))
+        gimp.progress_update(float(i) / len(frames))
 
-        # Process image one character square at a time
-        for x1 in range(0, width / 8):
-            
-            # Find the value of each pixel of character square
-            for y2 in range(0, 8):
-                for x2 in range(0, 8):
-                    y = y1 * 8 + y2
-                    x = x1 * 8 + x2
-		    
-                    dst_pos = (x + width * y) * pxl_size
-                    str1 = dst_pxl[dst_pos: dst_pos + pxl_size]
-                    b0[y2][x2] = str1[2]
-                    g0[y2][x2] = str1[1]
-                    r0[y2][x2] = str1[0]
-
-            # Find the mean r, g and b value of character square
-            bi, ri, gi = 0, 0, 0
-            for y2 in range(0, 8):
-                for x2 in range(0, 8):
-                    x = (x1 * 8) + x2
-                    y = (y1 * 8) + y2
-                    bi = bi + b0[y2][x2]
-                    gi = gi + g0[y2][x2]
-                    ri = ri + r0[y2][x2]
-
-            b = bi / 64
-            g = gi / 64
-            r = ri / 64
-
-	    # Work out if character square is "half bright"
-            xrreg = 0
-            hbrite = 0
-            if (r < hbedge) and (g < hbedge) and (b < hbedge):
-                hbrite = 1
-            hbampl = 255 - (hbrite * (255 - hbedge))
-
-            if b > hbampl / 2:
-                b = hbampl - b
-                xrreg = xrreg | 1
-
-            if r > hbampl / 2:
-                r = hbampl - r
-                xrreg=xrreg | 2
-
-            if g > hbampl / 2:
-                g = hbampl - g
-                xrreg = xrreg | 4
-
-            halbr = (r * rgrsp) / 100
-            halbg = (g * ggrsp) / 100
-            halbb = (b * bgrsp) / 100
-
-            vlik = 7
-            if((r > halbb) and (g <= halbb)) or ((b <= halbr) and (g <= halbr)):
-                vlik = 3
-            if((g > halbb) and (r<=halbb)) or ((b <= halbg) and(r <= halbg)):
-                vlik = 5
-            if((g > halbr) and (b<=halbr)) or ((r<=halbg) and (b <= halbg)):
-                vlik = 6
-            if((r <= halbb) and(g<=halbb)):
-                vlik = 1
-            if((b <= halbr) and (g<=halbr)):
-                vlik = 2
-            if((b <= halbg) and (r <= halbg)):
-                vlik = 4
-
-            # Set ink, paper and bright attributes for character square
-            brattr = 1 - hbrite
-            ikattr = (vlik ^ xrreg) # ^ is used for xor
-            paattr = xrreg
-
-            if ikattr < paattr:
-		ikattr, paattr = paattr, ikattr
-
-            ikval = ikattr + ((ikattr & 6) / 2)
-            paval = paattr + ((paattr & 6) / 2)
-
-            lumik = (ikval * 255) / 10
-            lumpa = (paval * 255) / 10
-
-            if brattr < 1:
-                lumik = (lumik * hbedge) / 255
-                lumpa = (lumpa * hbedge) / 255
+        width, height = frame.width, frame.height
+        dst_rgn = frame.get_pixel_rgn(0, 0, width, height, True, False)
+        dst_pxl = array("B", dst_rgn[0:width, 0:height])
+        pxl_size = dst_rgn.bpp
 
-            dflum = lumik - lumpa
+        # A frame of a different size starts again from scratch
+        if coder is None or (coder.width, coder.height, 
+                             coder.pxl_size) != (width, height, pxl_size):
+            coder = ZXFrames(width, height, pxl_size, hbedge, rgbsat,
+                             halftone, optimal, threshold)
+        attrs, bitmap = coder.frame(dst_pxl)
 
-            for y2 in range (0, 8):
-                for x2 in range (0, 8):
-                    y = y1 * 8 + y2
-                    x = x1 * 8 + x2
-                    b = b0[y2][x2]
-                    g = g0[y2][x2]
-                    r = r0[y2][x2]
-                    vlue = (b + (r * 3) + (g * 6)) / 10
-                    patgf = ((cluster[halftone][y2 & 3][x2 & 3] 
-                              + 1) * 255) / 16
-                    varnd = ((patgf * dflum) / 255) + lumpa
-                    ik = ikattr + (8 * brattr)
-                    if varnd > vlue:
-                        ik = paattr + (8 * brattr)
-
-                    dst_pos = (x + width * y) * pxl_size
-                    str2 = array("B", "\xff" * pxl_size)
-                    str2[0] = plte[ik] & 0x0000FF
-                    str2[1] = (plte[ik] & 0x00FF00) / 256
-                    str2[2] = (plte[ik] & 0xFF0000) / 65536
-                    dst_pxl[dst_pos : dst_pos + pxl_size] = str2
-                
-    # Copy the byte array back into the pixel region
-    dst_rgn[0:width, 0:height] = dst_pxl.tostring()
+        # Colour in the frame, leaving any part character squares black
+        cols, rows = width / 8, height / 8
+        black = array("B", "\x00\x00\x00" + "\xff" * (pxl_size - 3))
+        dst_pxl = array("B", black * (width * height))
+        dst_str = zx_render(attrs, bitmap, cols, rows, pxl_size)
+        span = cols * 8 * pxl_size
+        for y in range(0, rows * 8):
+            pos = y * width * pxl_size
+            dst_pxl[pos : pos + span] = array("B", dst_str[y * span : 
+                                                           (y + 1) * span])
+        dst_rgn[0:width, 0:height] = dst_pxl.tostring()
+        frame.update(0, 0, width, height)
 
-    # Update the processed layer
-    new_layer.update(0, 0, width, height)
-    new_layer.resize((width / 8) * 8, (height / 8) * 8, 0, 0)
+    img.undo_group_end()
+    gimp.context_pop()
 
-    # Merge processed layer into black layer
-    black_layer = pdb.gimp_image_merge_down(img, new_layer, CLIP_TO_IMAGE)
+def zxpalette(img, layer, palette):
 
-    # Merge black layer into the original
-    layer = pdb.gimp_image_merge_down(img, black_layer, CLIP_TO_IMAGE)
+    # Find the screen left on the layer by the ZX Spectrum filter, and
+    # make sure the layer still shows it rather than painting over changes
+    screen = find_screen(layer)
+    if screen is None:
+        if (layer.width / 8) * (layer.height / 8) > parasite_blocks:
+            gimp.message(_("This layer is too large for the ZX Spectrum "
+                           "filter to keep its screen, so it can't be "
+                           "coloured in again."))
+        else:
+            gimp.message(_("Run the ZX Spectrum filter on this layer first."))
+        return
+    cols, rows, attrs, bitmap = screen
+    if (cols, rows) != (layer.width / 8, layer.height / 8):
+        gimp.message(_("The layer has changed size since the ZX Spectrum "
+                       "filter was run on it. Run the filter again first."))
+        return
+    if not screen_matches(layer, screen):
+        gimp.message(_("The layer has been changed since the ZX Spectrum "
+                       "filter was run on it. Run the filter again first."))
+        return
+
+    gimp.context_push()
+    img.undo_group_start()
+
+    # Colour in the screen with the new palette - no need to look at the
+    # image again
+    dst_rgn = layer.get_pixel_rgn(0, 0, cols * 8, rows * 8, True, False)
+    dst_rgn[0:cols * 8, 0:rows * 8] = zx_render(attrs, bitmap, cols, rows,
+                                                dst_rgn.bpp,
+                                                palettes[palette][1])
+    layer.update(0, 0, cols * 8, rows * 8)
 
     img.undo_group_end()
     gimp.context_pop()
@@ -237,6 +1075,7 @@ register("python-fu-zxspectrum",
          "RGB*",
          [(PF_IMAGE, "image", _("Input image"), None),
           (PF_DRAWABLE, "drawable", _("Input drawable"), None),
+          #- halfbright attr edge -zx32=218, zx32fs=153 , realthing=180?
           (PF_SLIDER, "hbedge", _("Bright attribute at"), 180, (0, 255, 1)),
           (PF_SLIDER, "rgbsat", _("RGB saturation point"), 30, (0, 255, 1)),
           (PF_RADIO, "halftone", _("Halftone cluster"), 0,
@@ -247,4 +1086,165 @@ register("python-fu-zxspectrum",
          zxspectrum, 
          menu="<Image>/Filters/Retro Computing",
          domain=("gimp20-python", gimp.locale_directory))
+
+register("python-fu-zxspectrum-best",
+         N_("ZX Spectrum Image Filter choosing the best ink and paper for "
+            "each character square"),
+         "",
+         "Dave Jeffery",
+         "Dave Jeffery",
+         "2010",
+         N_("ZX Spectrum (_Best Match)"),
+         "RGB*",
+         [(PF_IMAGE, "image", _("Input image"), None),
+          (PF_DRAWABLE, "drawable", _("Input drawable"), None),
+          (PF_SLIDER, "hbedge", _("Bright attribute at"), 180, (0, 255, 1)),
+          (PF_SLIDER, "rgbsat", _("RGB saturation point"), 30, (0, 255, 1)),
+          (PF_RADIO, "halftone", _("Halftone cluster"), 0,
+           ((_("One"), 0),
+            (_("Two"), 1)))
+         ],
+         [],
+         zxbest, 
+         menu="<Image>/Filters/Retro Computing",
+         domain=("gimp20-python", gimp.locale_directory))
+
+register("python-fu-zxspectrum-preview",
+         N_("ZX Spectrum Image Filter with a live preview"),
+         "",
+         "Dave Jeffery",
+         "Dave Jeffery",
+         "2010",
+         N_("ZX Spectrum (_Preview)..."),
+         "RGB*",
+         [(PF_IMAGE, "image", _("Input image"), None),
+          (PF_DRAWABLE, "drawable", _("Input drawable"), None)
+         ],
+         [],
+         zxpreview, 
+         menu="<Image>/Filters/Retro Computing",
+         domain=("gimp20-python", gimp.locale_directory))
+
+register("python-fu-zxspectrum-region",
+         N_("ZX Spectrum Image Filter on the selected area only"),
+         "",
+         "Dave Jeffery",
+         "Dave Jeffery",
+         "2010",
+         N_("ZX Spectrum _Region"),
+         "RGB*",
+         [(PF_IMAGE, "image", _("Input image"), None),
+          (PF_DRAWABLE, "drawable", _("Input drawable"), None),
+          (PF_SLIDER, "hbedge", _("Bright attribute at"), 180, (0, 255, 1)),
+          (PF_SLIDER, "rgbsat", _("RGB saturation point"), 30, (0, 255, 1)),
+          (PF_RADIO, "halftone", _("Halftone cluster"), 0,
+           ((_("One"), 0),
+            (_("Two"), 1))),
+          (PF_RADIO, "optimal", _("Ink and paper"), 0,
+           ((_("Quick"), 0),
+            (_("Best match"), 1)))
+         ],
+         [],
+         zxregion, 
+         menu="<Image>/Filters/Retro Computing",
+         domain=("gimp20-python", gimp.locale_directory))
+
+register("python-fu-zxspectrum-animation",
+         N_("ZX Spectrum Animation Filter"),
+         "",
+         "Dave Jeffery",
+         "Dave Jeffery",
+         "2010",
+         N_("ZX Spectrum _Animation"),
+         "RGB*",
+         [(PF_IMAGE, "image", _("Input image"), None),
+          (PF_DRAWABLE, "drawable", _("Input drawable"), None),
+          (PF_SLIDER, "hbedge", _("Bright attribute at"), 180, (0, 255, 1)),
+          (PF_SLIDER, "rgbsat", _("RGB saturation point"), 30, (0, 255, 1)),
+          (PF_RADIO, "halftone", _("Halftone cluster"), 0,
+           ((_("One"), 0),
+            (_("Two"), 1))),
+          (PF_RADIO, "optimal", _("Ink and paper"), 0,
+           ((_("Quick"), 0),
+            (_("Best match"), 1))),
+          (PF_SLIDER, "threshold", _("Keep squares changing less than"), 
+           4, (0, 64, 1))
+         ],
+         [],
+         zxanimation, 
+         menu="<Image>/Filters/Retro Computing",
+         domain=("gimp20-python", gimp.locale_directory))
+
+register("python-fu-zxspectrum-palette",
+         N_("Colour in a ZX Spectrum filtered layer with another palette"),
+         "",
+         "Dave Jeffery",
+         "Dave Jeffery",
+         "2010",
+         N_("ZX Spectrum _Palette"),
+         "RGB*",
+         [(PF_IMAGE, "image", _("Input image"), None),
+          (PF_DRAWABLE, "drawable", _("Input drawable"), None),
+          (PF_OPTION, "palette", _("Palette"), 0,
+           [_(name) for name, colours in palettes])
+         ],
+         [],
+         zxpalette, 
+         menu="<Image>/Filters/Retro Computing",
+         domain=("gimp20-python", gimp.locale_directory))
+
+register("file-zxscr-load",
+         N_("Load a ZX Spectrum screen (.SCR)"),
+         "",
+         "Dave Jeffery",
+         "Dave Jeffery",
+         "2010",
+         N_("ZX Spectrum screen"),
+         None,
+         [(PF_STRING, "filename", _("The name of the file to load"), None),
+          (PF_STRING, "raw-filename", _("The name entered"), None)
+         ],
+         [(PF_IMAGE, "image", _("Output image"))],
+         load_scr, 
+         on_query=register_scr_load,
+         menu="<Load>",
+         domain=("gimp20-python", gimp.locale_directory))
+
+register("file-zxscr-save",
+         N_("Save as a ZX Spectrum screen (.SCR)"),
+         "",
+         "Dave Jeffery",
+         "Dave Jeffery",
+         "2010",
+         N_("ZX Spectrum screen"),
+         "RGB*",
+         [(PF_IMAGE, "image", _("Input image"), None),
+          (PF_DRAWABLE, "drawable", _("Input drawable"), None),
+          (PF_STRING, "filename", _("The name of the file to save"), None),
+          (PF_STRING, "raw-filename", _("The name entered"), None)
+         ],
+         [],
+         save_scr, 
+         on_query=register_scr_save,
+         menu="<Save>",
+         domain=("gimp20-python", gimp.locale_directory))
+
+register("file-zxtiles-save",
+         N_("Save as ZX Spectrum tiles and map (.zxt, .map)"),
+         "",
+         "Dave Jeffery",
+         "Dave Jeffery",
+         "2010",
+         N_("ZX Spectrum tiles"),
+         "RGB*",
+         [(PF_IMAGE, "image", _("Input image"), None),
+          (PF_DRAWABLE, "drawable", _("Input drawable"), None),
+          (PF_STRING, "filename", _("The name of the file to save"), None),
+          (PF_STRING, "raw-filename", _("The name entered"), None)
+         ],
+         [],
+         save_tiles, 
+         on_query=register_tiles_save,
+         menu="<Save>",
+         domain=("gimp20-python", gimp.locale_directory))
 main()